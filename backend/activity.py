@@ -0,0 +1,96 @@
+# ========== GO FISH! ACTIVITY TRACKER ==========
+# Coalesces presence updates in memory and writes them in one batch per interval
+
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from pymongo import UpdateOne
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSH_SECONDS = float(os.environ.get("ACTIVITY_FLUSH_SECONDS", "60"))
+ONLINE_WINDOW_SECONDS = 300.0
+
+
+class ActivityTracker:
+    """Last-seen times per user, flushed to users and guild_members in bulk"""
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        # user_id -> (latest ISO timestamp, guild_id) waiting to be written
+        self.pending: Dict[str, Tuple[str, Optional[str]]] = {}
+        # guild_id -> user_id -> monotonic time last seen, for online counts
+        self.guild_presence: Dict[str, Dict[str, float]] = {}
+
+    def touch(self, user_id: str, guild_id: Optional[str] = None):
+        """Record activity now; repeated touches before a flush cost nothing extra"""
+        self.pending[user_id] = (datetime.now(timezone.utc).isoformat(), guild_id)
+        if guild_id:
+            self.guild_presence.setdefault(guild_id, {})[user_id] = time.monotonic()
+
+    def online_count(self, guild_id: str, window: float = ONLINE_WINDOW_SECONDS) -> int:
+        """Members of a guild active within the window, as seen by this worker"""
+        return self._prune_guild(guild_id, time.monotonic() - window)
+
+    def prune(self, window: float = ONLINE_WINDOW_SECONDS):
+        """Forget presence older than the window in every guild, queried or not"""
+        cutoff = time.monotonic() - window
+        for guild_id in list(self.guild_presence):
+            self._prune_guild(guild_id, cutoff)
+
+    def _prune_guild(self, guild_id: str, cutoff: float) -> int:
+        presence = self.guild_presence.get(guild_id)
+        if not presence:
+            return 0
+        for user_id in [u for u, seen in presence.items() if seen < cutoff]:
+            del presence[user_id]
+        if not presence:
+            del self.guild_presence[guild_id]
+        return len(presence)
+
+    async def flush(self, db) -> int:
+        """Write every coalesced update in one bulk_write per collection"""
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, {}
+
+        # $max keeps a slower worker's flush from moving last_active backwards
+        users = [
+            UpdateOne({"id": user_id}, {"$max": {"last_active": seen_at}})
+            for user_id, (seen_at, _) in pending.items()
+        ]
+        members = [
+            UpdateOne({"guild_id": guild_id, "user_id": user_id}, {"$max": {"last_active": seen_at}})
+            for user_id, (seen_at, guild_id) in pending.items() if guild_id
+        ]
+        try:
+            await db.users.bulk_write(users, ordered=False)
+            if members:
+                await db.guild_members.bulk_write(members, ordered=False)
+        except Exception:
+            self._requeue(pending)
+            raise
+        return len(pending)
+
+    def _requeue(self, pending: Dict[str, Tuple[str, Optional[str]]]):
+        """Put a failed batch back, keeping the newer of two timestamps per user"""
+        for user_id, (seen_at, guild_id) in pending.items():
+            current = self.pending.get(user_id)
+            if current is None or current[0] < seen_at:
+                self.pending[user_id] = (seen_at, guild_id)
+
+    async def run(self, db):
+        """Flush loop for a router's startup hook"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.prune()
+            try:
+                await self.flush(db)
+            except Exception as e:
+                logger.error(f"Activity flush failed: {e}")
+
+
+activity_tracker = ActivityTracker()
@@ -0,0 +1,117 @@
+# ========== GO FISH! GUILD CONTRIBUTION CONCURRENCY BENCHMARK ==========
+# A full 30-member guild contributes at the same moment; afterwards the guild's
+# level, XP and treasury must match what sequential contributions would give.
+#
+# Usage (from backend/, with MONGO_URL and DB_NAME set):
+#     python benchmarks/guild_contribute_bench.py --members 30 --rounds 5
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+from fastapi import HTTPException
+
+import guild_routes
+from guild_routes import ContributeRequest, contribute_to_guild, db
+
+
+def expected_progress(total_xp: int):
+    """Level and leftover XP after applying all XP one level at a time"""
+    level, xp = 1, total_xp
+    while level < guild_routes.GUILD_MAX_LEVEL and xp >= guild_routes._xp_for_next_level(level):
+        xp -= guild_routes._xp_for_next_level(level)
+        level += 1
+    return level, xp
+
+
+async def run(members: int, rounds: int, amount: int):
+    run_id = uuid.uuid4().hex[:8]
+    guild_id = f"bench-{run_id}"
+    await db.guilds.insert_one({
+        "id": guild_id,
+        "name": f"Bench Guild {run_id}",
+        "tag": "BNCH",
+        "leader_id": f"bench-{run_id}-0",
+        "level": 1,
+        "experience": 0,
+        "max_members": 30,
+        "member_count": members,
+        "perks": [],
+        "treasury": {"coins": 0, "gems": 0},
+        "weekly_contribution": 0,
+    })
+    await db.guild_members.insert_many([
+        {"id": str(uuid.uuid4()), "guild_id": guild_id, "user_id": f"bench-{run_id}-{i}",
+         "username": f"Bench{i}", "rank": "member", "contribution_points": 0}
+        for i in range(members)
+    ])
+    # The last member can only afford all but one of their contributions
+    await db.users.insert_many([
+        {"id": f"bench-{run_id}-{i}", "username": f"Bench{i}",
+         "score": amount * rounds - (amount if i == members - 1 else 0)}
+        for i in range(members)
+    ])
+
+    requests = [
+        ContributeRequest(user_id=f"bench-{run_id}-{i}", contribution_type="coins", amount=amount)
+        for _ in range(rounds) for i in range(members)
+    ]
+    outcomes = Counter()
+
+    async def attempt(request):
+        try:
+            await contribute_to_guild(guild_id, request)
+            outcomes["contributed"] += 1
+        except HTTPException as e:
+            outcomes[e.detail] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(r) for r in requests))
+    elapsed = time.perf_counter() - started
+
+    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0})
+    negative = await db.users.count_documents({"id": {"$regex": f"^bench-{run_id}-"}, "score": {"$lt": 0}})
+    contributed = outcomes["contributed"]
+    level, xp = expected_progress(contributed * (amount // 10))
+
+    print(f"contributions:     {len(requests)} from {members} members")
+    print(f"elapsed:           {elapsed:.2f}s ({len(requests) / elapsed:.0f}/s)")
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome:<22} {count}")
+    print(f"guild level / xp:  {guild['level']} / {guild['experience']} (expected {level} / {xp})")
+    print(f"treasury coins:    {guild['treasury']['coins']} (expected {contributed * amount})")
+    print(f"negative balances: {negative}")
+
+    ok = (
+        guild["level"] == level
+        and guild["experience"] == xp
+        and guild["treasury"]["coins"] == contributed * amount
+        and guild["max_members"] == 30 + (level - 1) * 5
+        and negative == 0
+    )
+    print("RESULT:", "OK" if ok else "INVARIANT VIOLATED")
+
+    await db.guilds.delete_one({"id": guild_id})
+    await db.guild_members.delete_many({"guild_id": guild_id})
+    await db.users.delete_many({"id": {"$regex": f"^bench-{run_id}-"}})
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guild contribution concurrency benchmark")
+    parser.add_argument("--members", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--amount", type=int, default=2000)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.members, args.rounds, args.amount))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,111 @@
+# ========== GO FISH! TOURNAMENT JOIN CONCURRENCY BENCHMARK ==========
+# Fires a launch rush of simultaneous joins at one paid tournament and checks
+# that capacity, balances and entry uniqueness all hold afterwards.
+#
+# Usage (from backend/, with MONGO_URL and DB_NAME set):
+#     python benchmarks/tournament_join_bench.py --joins 5000 --capacity 1000
+
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+from fastapi import HTTPException
+
+import tournament_routes
+from tournament_routes import JoinTournamentRequest, db, join_tournament
+
+
+async def run(joins: int, capacity: int, fee: int, duplicate_every: int):
+    await tournament_routes.ensure_tournament_indexes()
+
+    run_id = uuid.uuid4().hex[:8]
+    tournament_id = f"bench-{run_id}"
+    await db.tournaments.insert_one({
+        "id": tournament_id,
+        "name": f"Join Benchmark {run_id}",
+        "description": "Concurrency benchmark",
+        "tournament_type": "benchmark",
+        "entry_fee": fee,
+        "entry_currency": "coins",
+        "max_participants": capacity,
+        "current_participants": 0,
+        "status": "active",
+        "reward_tiers": [],
+    })
+
+    # Every seventh player is one coin short of the fee
+    users = []
+    for i in range(joins):
+        coins = fee - 1 if i % 7 == 0 else fee
+        users.append({"id": f"bench-{run_id}-{i}", "username": f"Bench{i}", "coins": coins})
+    await db.users.insert_many(users)
+
+    requests = [JoinTournamentRequest(user_id=u["id"], username=u["username"]) for u in users]
+    # Double-tapped join buttons
+    requests += [requests[i] for i in range(0, joins, duplicate_every)]
+
+    outcomes = Counter()
+
+    async def attempt(request):
+        try:
+            await join_tournament(tournament_id, request)
+            outcomes["joined"] += 1
+        except HTTPException as e:
+            outcomes[e.detail] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(r) for r in requests))
+    elapsed = time.perf_counter() - started
+
+    tournament = await db.tournaments.find_one({"id": tournament_id}, {"_id": 0})
+    entry_count = await db.tournament_entries.count_documents({"tournament_id": tournament_id})
+    negative = await db.users.count_documents({"id": {"$regex": f"^bench-{run_id}-"}, "coins": {"$lt": 0}})
+    coins_left = await db.users.aggregate([
+        {"$match": {"id": {"$regex": f"^bench-{run_id}-"}}},
+        {"$group": {"_id": None, "coins": {"$sum": "$coins"}}}
+    ]).to_list(1)
+    coins_spent = sum(u["coins"] for u in users) - (coins_left[0]["coins"] if coins_left else 0)
+
+    print(f"requests:              {len(requests)}")
+    print(f"elapsed:               {elapsed:.2f}s ({len(requests) / elapsed:.0f} joins/s)")
+    for outcome, count in outcomes.most_common():
+        print(f"  {outcome:<28} {count}")
+    print(f"current_participants:  {tournament['current_participants']} / {capacity}")
+    print(f"entries stored:        {entry_count}")
+    print(f"coins spent on fees:   {coins_spent} (expected {entry_count * fee})")
+    print(f"negative balances:     {negative}")
+
+    ok = (
+        entry_count == outcomes["joined"]
+        and tournament["current_participants"] == entry_count
+        and entry_count <= capacity
+        and coins_spent == entry_count * fee
+        and negative == 0
+    )
+    print("RESULT:", "OK" if ok else "INVARIANT VIOLATED")
+
+    await db.tournaments.delete_one({"id": tournament_id})
+    await db.tournament_entries.delete_many({"tournament_id": tournament_id})
+    await db.users.delete_many({"id": {"$regex": f"^bench-{run_id}-"}})
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tournament join concurrency benchmark")
+    parser.add_argument("--joins", type=int, default=5000)
+    parser.add_argument("--capacity", type=int, default=1000)
+    parser.add_argument("--fee", type=int, default=500)
+    parser.add_argument("--duplicate-every", type=int, default=10)
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.joins, args.capacity, args.fee, args.duplicate_every))
+    sys.exit(0 if ok else 1)
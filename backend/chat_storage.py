@@ -0,0 +1,164 @@
+# ========== GO FISH! CHAT MESSAGE STORAGE ==========
+# One document per message (default) or time-bucketed documents holding up to
+# BUCKET_SIZE messages of one channel and hour (CHAT_STORAGE_MODE=bucket)
+
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import os
+
+CHAT_STORAGE_MODE = os.environ.get("CHAT_STORAGE_MODE", "document")
+BUCKET_SIZE = 200
+MIGRATION_BATCH_SIZE = 5000
+
+DUPLICATE_KEY = 11000
+
+
+def bucket_mode() -> bool:
+    return CHAT_STORAGE_MODE == "bucket"
+
+
+def _hour(created_at: str) -> str:
+    """Time slice of an ISO timestamp, e.g. 2026-10-19T14"""
+    return created_at[:13]
+
+
+async def ensure_chat_indexes(db):
+    """Create the indexes for whichever storage mode is active"""
+    if bucket_mode():
+        await db.chat_buckets.create_index("id", unique=True)
+        await db.chat_buckets.create_index([("channel", 1), ("last_at", -1)])
+    else:
+        await db.chat_messages.create_index("id", unique=True)
+        await db.chat_messages.create_index([("channel", 1), ("created_at", -1)])
+
+
+async def store_messages(db, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Persist a batch of chat messages and return the ones that could not be written"""
+    if not messages:
+        return []
+    if not bucket_mode():
+        try:
+            await db.chat_messages.insert_many(messages, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates were stored by an earlier attempt of the same batch
+            return [
+                messages[err["index"]] for err in e.details["writeErrors"]
+                if err["code"] != DUPLICATE_KEY
+            ]
+        return []
+    
+    # Group by channel and hour, then push each group into a bucket with room for it
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for message in messages:
+        groups.setdefault((message["channel"], _hour(message["created_at"])), []).append(message)
+    
+    updates = []
+    pieces = []
+    for (channel, hour), group in groups.items():
+        for start in range(0, len(group), BUCKET_SIZE):
+            piece = group[start:start + BUCKET_SIZE]
+            pieces.append(piece)
+            updates.append(UpdateOne(
+                {"channel": channel, "hour": hour, "count": {"$lte": BUCKET_SIZE - len(piece)}},
+                {
+                    "$push": {"messages": {"$each": piece}},
+                    "$inc": {"count": len(piece)},
+                    "$min": {"first_at": piece[0]["created_at"]},
+                    "$max": {"last_at": piece[-1]["created_at"]},
+                    "$setOnInsert": {"id": f"{channel}:{piece[0]['id']}"}
+                },
+                upsert=True
+            ))
+    try:
+        await db.chat_buckets.bulk_write(updates, ordered=False)
+    except BulkWriteError as e:
+        return [m for err in e.details["writeErrors"] for m in pieces[err["index"]]]
+    return []
+
+
+async def read_messages(db, channel: str, limit: int, before: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Newest `limit` messages of a channel older than `before`, oldest first"""
+    if not bucket_mode():
+        query = {"channel": channel}
+        if before:
+            query["created_at"] = {"$lt": before}
+        messages = await db.chat_messages.find(
+            query,
+            {"_id": 0}
+        ).sort("created_at", -1).limit(limit).to_list(limit)
+        return list(reversed(messages))
+    
+    query = {"channel": channel}
+    if before:
+        query["first_at"] = {"$lt": before}
+    
+    # Walk buckets newest first until enough messages are collected; a batch
+    # retried after an ambiguous failure may have been pushed twice
+    collected: List[Dict[str, Any]] = []
+    seen = set()
+    cursor = db.chat_buckets.find(query, {"_id": 0, "messages": 1}).sort("last_at", -1)
+    async for bucket in cursor:
+        for m in bucket["messages"]:
+            if m["id"] not in seen and (not before or m["created_at"] < before):
+                seen.add(m["id"])
+                collected.append(m)
+        if len(collected) >= limit:
+            break
+    
+    collected.sort(key=lambda m: m["created_at"])
+    return collected[-limit:] if limit > 0 else []
+
+
+async def migrate_to_buckets(db) -> Dict[str, int]:
+    """Move per-message documents into buckets; safe to re-run after an interruption"""
+    cursor = db.chat_messages.find({}, {"_id": 0}).sort([("channel", 1), ("created_at", 1)])
+    
+    moved = 0
+    buckets = 0
+    batch: List[Dict[str, Any]] = []
+    async for message in cursor:
+        batch.append(message)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            buckets += await _migrate_batch(db, batch)
+            moved += len(batch)
+            batch = []
+    if batch:
+        buckets += await _migrate_batch(db, batch)
+        moved += len(batch)
+    
+    return {"messages_moved": moved, "buckets_written": buckets}
+
+
+async def _migrate_batch(db, messages: List[Dict[str, Any]]) -> int:
+    docs = []
+    current = None
+    for message in messages:
+        key = (message["channel"], _hour(message["created_at"]))
+        if current is None or current["key"] != key or len(current["messages"]) >= BUCKET_SIZE:
+            current = {"key": key, "messages": []}
+            docs.append(current)
+        current["messages"].append(message)
+    
+    # Bucket ids derive from their first message, so a re-run after a crash
+    # between insert and delete hits duplicate keys instead of copying twice
+    buckets = [
+        {
+            "id": f"{doc['key'][0]}:{doc['messages'][0]['id']}",
+            "channel": doc["key"][0],
+            "hour": doc["key"][1],
+            "count": len(doc["messages"]),
+            "first_at": doc["messages"][0]["created_at"],
+            "last_at": doc["messages"][-1]["created_at"],
+            "messages": doc["messages"],
+        }
+        for doc in docs
+    ]
+    try:
+        await db.chat_buckets.insert_many(buckets, ordered=False)
+    except BulkWriteError as e:
+        if any(err["code"] != DUPLICATE_KEY for err in e.details["writeErrors"]):
+            raise
+    
+    await db.chat_messages.delete_many({"id": {"$in": [m["id"] for m in messages]}})
+    return len(buckets)
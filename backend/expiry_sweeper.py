@@ -0,0 +1,130 @@
+# ========== GO FISH! EXPIRY SWEEPER ==========
+# Background job closing out pending items whose time ran out: guild
+# challenges (pending and overrunning active ones), guild applications and gifts
+
+from fastapi import APIRouter
+from motor.motor_asyncio import AsyncIOMotorClient
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List
+from pymongo import UpdateOne
+import asyncio
+import logging
+import uuid
+import os
+
+router = APIRouter(prefix="/api/maintenance", tags=["maintenance"])
+logger = logging.getLogger(__name__)
+
+# MongoDB connection
+mongo_url = os.environ.get('MONGO_URL')
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ.get('DB_NAME')]
+
+SWEEP_INTERVAL_SECONDS = 300
+SWEEP_BATCH_SIZE = 1000
+APPLICATION_TTL_DAYS = 14
+
+
+@router.on_event("startup")
+async def start_expiry_sweeper():
+    """Create the range indexes the sweeper relies on and start its loop"""
+    await db.guild_challenges.create_index([("status", 1), ("expires_at", 1)])
+    await db.guild_challenges.create_index([("status", 1), ("ends_at", 1)])
+    await db.guild_applications.create_index([("status", 1), ("applied_at", 1)])
+    await db.gifts.create_index([("status", 1), ("expires_at", 1)])
+    asyncio.create_task(_sweeper_loop())
+
+
+async def _expire_in_batches(collection, query: Dict[str, Any], update: Dict[str, Any]) -> int:
+    """Transition every document matching an indexed range query, one batch of ids at a time"""
+    expired = 0
+    while True:
+        batch = await collection.find(query, {"_id": 1}).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+        if not batch:
+            return expired
+        # Re-check the query so anything that changed state meanwhile is left alone
+        result = await collection.update_many({"_id": {"$in": [d["_id"] for d in batch]}, **query}, update)
+        expired += result.modified_count
+        if len(batch) < SWEEP_BATCH_SIZE:
+            return expired
+
+
+async def _expire_active_challenges(now: str) -> Dict[str, int]:
+    """Close active challenges that ran out of time without a winner and refund both stakes"""
+    expired = 0
+    refunded = 0
+    query = {"status": "active", "ends_at": {"$lte": now}}
+    while True:
+        batch = await db.guild_challenges.find(query, {"_id": 1}).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+        if not batch:
+            break
+        
+        # Tag the transition with this sweep, so only challenges this run
+        # actually expired get their stakes back - exactly once
+        sweep_id = str(uuid.uuid4())
+        result = await db.guild_challenges.update_many(
+            {"_id": {"$in": [d["_id"] for d in batch]}, **query},
+            {"$set": {"status": "expired", "expired_at": now, "sweep_id": sweep_id}}
+        )
+        expired += result.modified_count
+        
+        refunds: List[UpdateOne] = []
+        async for challenge in db.guild_challenges.find(
+            {"sweep_id": sweep_id},
+            {"_id": 0, "challenger_guild_id": 1, "defender_guild_id": 1, "stake": 1}
+        ):
+            stake = challenge.get("stake", {}).get("coins", 0)
+            if stake > 0:
+                for guild_id in (challenge["challenger_guild_id"], challenge["defender_guild_id"]):
+                    refunds.append(UpdateOne({"id": guild_id}, {"$inc": {"treasury.coins": stake}}))
+        if refunds:
+            await db.guilds.bulk_write(refunds, ordered=False)
+            refunded += len(refunds)
+        
+        if len(batch) < SWEEP_BATCH_SIZE:
+            break
+    return {"active_challenges_expired": expired, "stakes_refunded": refunded}
+
+
+async def sweep_expired() -> Dict[str, int]:
+    """Run one sweep over every collection and report how many items were closed"""
+    now = datetime.now(timezone.utc).isoformat()
+    application_cutoff = (datetime.now(timezone.utc) - timedelta(days=APPLICATION_TTL_DAYS)).isoformat()
+    
+    report = {
+        "pending_challenges_expired": await _expire_in_batches(
+            db.guild_challenges,
+            {"status": "pending", "expires_at": {"$lte": now}},
+            {"$set": {"status": "expired", "expired_at": now}}
+        ),
+        "applications_expired": await _expire_in_batches(
+            db.guild_applications,
+            {"status": "pending", "applied_at": {"$lte": application_cutoff}},
+            {"$set": {"status": "expired", "expired_at": now}}
+        ),
+        "gifts_expired": await _expire_in_batches(
+            db.gifts,
+            {"status": "pending", "expires_at": {"$lte": now}},
+            {"$set": {"status": "expired", "expired_at": now}}
+        ),
+    }
+    report.update(await _expire_active_challenges(now))
+    return report
+
+
+async def _sweeper_loop():
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            report = await sweep_expired()
+            if any(report.values()):
+                logger.info(f"Expiry sweep: {report}")
+        except Exception as e:
+            logger.error(f"Expiry sweep failed: {e}")
+
+
+@router.post("/sweep-expired")
+async def admin_sweep_expired():
+    """Admin endpoint to run the expiry sweep now"""
+    report = await sweep_expired()
+    return {"success": True, **report}
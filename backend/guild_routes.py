@@ -2,14 +2,30 @@
 # Social guild system with challenges, contributions, and perks
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, Field
+from pymongo import ReturnDocument, UpdateMany
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from collections import deque
+import asyncio
+import bisect
+import logging
+import random
 import uuid
 import os
+import time
+
+from activity import activity_tracker
+from chat_storage import bucket_mode, ensure_chat_indexes, migrate_to_buckets, read_messages, store_messages
+from notification_dispatcher import dispatcher
+from realtime import SSE_HEADERS, Subscriber, format_sse, get_pubsub, sse_stream
+from text_search import SEARCH_FIELD, backfill_search_terms, prefix_filter, rank_matches, search_terms
 
 router = APIRouter(prefix="/api/guilds", tags=["guilds"])
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL')
@@ -17,6 +33,31 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME')]
 
 
+@router.on_event("startup")
+async def ensure_guild_indexes():
+    """Create indexes the guild endpoints rely on"""
+    await db.guilds.create_index(SEARCH_FIELD)
+    await db.guild_counter_shards.create_index([("guild_id", 1), ("shard", 1)], unique=True)
+    await db.guilds.create_index([("level", -1), ("experience", -1), ("id", 1)])
+    await db.guilds.create_index([("weekly_contribution", -1), ("id", 1)])
+    await db.guild_members.create_index([("guild_id", 1), ("inactive", 1), ("last_active", 1)])
+    await db.guild_weekly_history.create_index([("guild_id", 1), ("week", -1)])
+    await db.job_runs.create_index("id", unique=True)
+    await ensure_chat_indexes(db)
+    asyncio.create_task(backfill_search_terms(db.guilds, ["name", "tag"]))
+    asyncio.create_task(_compaction_loop())
+    asyncio.create_task(_chat_writer_loop())
+    asyncio.create_task(_weekly_reset_loop())
+    asyncio.create_task(activity_tracker.run(db))
+
+
+@router.on_event("shutdown")
+async def flush_guild_chat():
+    """Persist chat messages and presence updates still waiting in memory"""
+    await _flush_chat_writes()
+    await activity_tracker.flush(db)
+
+
 # ========== REQUEST/RESPONSE MODELS ==========
 
 class CreateGuildRequest(BaseModel):
@@ -58,12 +99,25 @@ class GuildChallengeRequest(BaseModel):
     stake_coins: int = 0
 
 
+class ChallengeCatchEvent(BaseModel):
+    guild_id: str
+    fish_count: int = 1
+    score: int = 0
+    fish_size: int = 0
+
+
 class GuildChatRequest(BaseModel):
     user_id: str
     username: str
     message: str
 
 
+class GuildAnnouncementRequest(BaseModel):
+    user_id: str
+    title: str
+    message: str
+
+
 # ========== GUILD RANKS CONFIGURATION ==========
 
 DEFAULT_RANKS = [
@@ -86,6 +140,310 @@ GUILD_PERKS = {
     10: ["bonus_xp_25", "bonus_coins_25", "extra_energy_25", "rare_fish_boost_20", "exclusive_badge", "legendary_lure"],
 }
 
+GUILD_MAX_LEVEL = max(GUILD_PERKS)
+
+
+# ========== GUILD ROSTER CACHE ==========
+
+# Compact member card used by guild screens and the member leaderboard
+ROSTER_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "username": 1,
+    "rank": 1,
+    "contribution_points": 1,
+    "joined_at": 1,
+    "last_active": 1,
+}
+
+MEMBER_PAGE_SIZE = 20
+ROSTER_CACHE_TTL_SECONDS = 60.0
+
+_roster_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+
+
+async def _guild_roster(guild_id: str) -> List[Dict[str, Any]]:
+    """All members of a guild sorted by contribution, cached until a membership change"""
+    cached = _roster_cache.get(guild_id)
+    if cached and time.monotonic() - cached[0] < ROSTER_CACHE_TTL_SECONDS:
+        return cached[1]
+    
+    members = await db.guild_members.find(
+        {"guild_id": guild_id},
+        ROSTER_PROJECTION
+    ).sort("contribution_points", -1).to_list(None)
+    _roster_cache[guild_id] = (time.monotonic(), members)
+    return members
+
+
+def _invalidate_roster(guild_id: str):
+    """Forget a guild's cached roster after a join, leave, kick, promotion or contribution"""
+    _roster_cache.pop(guild_id, None)
+
+
+# ========== GUILD COUNTER SHARDS ==========
+
+# Opt-in per guild (counter_shards > 0): treasury, experience and weekly
+# contribution increments land on one of N shard documents instead of the hot
+# guild document. Reads add the shards back in; compaction folds them into the
+# guild and applies any level-ups the folded XP earned.
+
+MAX_COUNTER_SHARDS = 16
+COMPACTION_INTERVAL_SECONDS = 30.0
+
+_transactions_supported = True
+
+
+def _flatten_counters(doc: Dict[str, Any]) -> Dict[str, int]:
+    """Dotted-path view of a shard's counters, e.g. {"treasury.coins": 50}"""
+    flat = {}
+    for key, value in (doc.get("treasury") or {}).items():
+        flat[f"treasury.{key}"] = value
+    for key in ("experience", "weekly_contribution"):
+        if key in doc:
+            flat[key] = doc[key]
+    return flat
+
+
+async def _increment_guild_counters(guild_id: str, shards: int, inc: Dict[str, int]):
+    """Apply counter increments to the guild, or to a random shard when sharding is on"""
+    if shards:
+        await db.guild_counter_shards.update_one(
+            {"guild_id": guild_id, "shard": random.randrange(shards)},
+            {"$inc": inc},
+            upsert=True
+        )
+    else:
+        await db.guilds.update_one({"id": guild_id}, {"$inc": inc})
+
+
+async def _with_shard_totals(guild: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Add un-compacted shard counters into a guild document read from the database"""
+    if not guild or not guild.get("counter_shards"):
+        return guild
+    async for shard in db.guild_counter_shards.find({"guild_id": guild["id"]}, {"_id": 0}):
+        for path, value in _flatten_counters(shard).items():
+            if path.startswith("treasury."):
+                treasury = guild.setdefault("treasury", {})
+                key = path.split(".", 1)[1]
+                treasury[key] = treasury.get(key, 0) + value
+            else:
+                guild[path] = guild.get(path, 0) + value
+    return guild
+
+
+async def compact_guild_counters(guild_id: str) -> int:
+    """Fold every shard of one guild back into the guild document"""
+    global _transactions_supported
+    folded = 0
+    async for shard in db.guild_counter_shards.find({"guild_id": guild_id}):
+        values = {path: value for path, value in _flatten_counters(shard).items() if value}
+        if not values:
+            await db.guild_counter_shards.delete_one({"_id": shard["_id"], **_zeroed(shard)})
+            continue
+        
+        # Subtract exactly what was read; a concurrent increment or another
+        # compactor changes the values, the filter misses and we retry next pass
+        claim = ({"_id": shard["_id"], **values}, {"$inc": {k: -v for k, v in values.items()}})
+        fold = ({"id": guild_id}, {"$inc": values})
+        
+        if _transactions_supported:
+            async def fold_shard(session, claim=claim, fold=fold) -> int:
+                claimed = await db.guild_counter_shards.update_one(*claim, session=session)
+                if claimed.modified_count:
+                    await db.guilds.update_one(*fold, session=session)
+                return claimed.modified_count
+            
+            try:
+                async with await client.start_session() as session:
+                    # Retries transient failures such as write conflicts with another compactor
+                    folded += await session.with_transaction(fold_shard)
+                continue
+            except PyMongoError as e:
+                if not (isinstance(e, OperationFailure) and e.code == 20):
+                    # Still failing after the retries - leave the shard for the next pass
+                    logger.warning(f"Skipped counter shard of guild {guild_id}: {e}")
+                    continue
+                _transactions_supported = False  # IllegalOperation: standalone server
+        
+        claimed = await db.guild_counter_shards.update_one(*claim)
+        if claimed.modified_count:
+            await db.guilds.update_one(*fold)
+            folded += 1
+    
+    guild = await db.guilds.find_one({"id": guild_id}, LEVEL_PROJECTION)
+    if guild:
+        guild, _ = await _apply_level_ups(guild_id, guild)
+        _update_guild_boards(guild)
+    return folded
+
+
+def _zeroed(shard: Dict[str, Any]) -> Dict[str, int]:
+    """Filter matching a shard only while all of its counters are still zero"""
+    return {path: 0 for path in _flatten_counters(shard)}
+
+
+async def compact_all_guild_counters() -> Dict[str, int]:
+    """Compact every guild that currently has shard documents"""
+    guild_ids = await db.guild_counter_shards.distinct("guild_id")
+    folded = 0
+    for guild_id in guild_ids:
+        folded += await compact_guild_counters(guild_id)
+    return {"guilds": len(guild_ids), "shards_folded": folded}
+
+
+async def _compaction_loop():
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
+        try:
+            await compact_all_guild_counters()
+        except Exception as e:
+            logger.error(f"Guild counter compaction failed: {e}")
+
+
+async def _debit_treasury(guild_id: str, coins: int) -> bool:
+    """Take coins from a guild treasury only if it can cover them"""
+    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0, "counter_shards": 1})
+    if guild and guild.get("counter_shards"):
+        # Debits are rare; fold the shards so the guard sees the full balance
+        await compact_guild_counters(guild_id)
+    result = await db.guilds.update_one(
+        {"id": guild_id, "treasury.coins": {"$gte": coins}},
+        {"$inc": {"treasury.coins": -coins}}
+    )
+    return result.modified_count > 0
+
+
+# ========== GUILD LEADERBOARD ==========
+
+# The top of each board is cached and patched in place whenever this worker
+# changes a guild's standing; the TTL picks up changes made by other workers
+# and the display fields (member count, fish caught) that drift in between.
+# Registered ahead of /{guild_id} so the path parameter doesn't capture them.
+
+LEADERBOARD_CACHE_SIZE = 200
+LEADERBOARD_CACHE_TTL_SECONDS = 300
+GUILD_ROW_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "tag": 1, "icon": 1, "level": 1, "experience": 1,
+    "weekly_contribution": 1, "member_count": 1, "total_fish_caught": 1
+}
+
+
+class GuildBoard:
+    """Cached, ordered top-N of one guild ranking"""
+    
+    def __init__(self, sort: List[Tuple[str, int]]):
+        self.sort = sort
+        self.rows: List[Dict[str, Any]] = []
+        self.keys: List[tuple] = []
+        self.loaded_at: Optional[float] = None
+    
+    def key(self, guild: Dict[str, Any]) -> tuple:
+        # Ascending tuple: best guild first, ties broken by id
+        return tuple(guild.get(field, 0) * direction for field, direction in self.sort) + (guild["id"],)
+    
+    def ahead_filter(self, guild: Dict[str, Any]) -> Dict[str, Any]:
+        """Guilds ranked strictly ahead of this one"""
+        clauses = []
+        for i, (field, direction) in enumerate(self.sort):
+            clause = {f: guild.get(f, 0) for f, _ in self.sort[:i]}
+            clause[field] = {"$gt" if direction < 0 else "$lt": guild.get(field, 0)}
+            clauses.append(clause)
+        tie = {f: guild.get(f, 0) for f, _ in self.sort}
+        tie["id"] = {"$lt": guild["id"]}
+        clauses.append(tie)
+        return {"$or": clauses}
+    
+    def fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < LEADERBOARD_CACHE_TTL_SECONDS
+    
+    async def top(self, limit: int) -> List[Dict[str, Any]]:
+        if not self.fresh():
+            rows = await db.guilds.find({}, GUILD_ROW_PROJECTION).sort(
+                self.sort + [("id", 1)]
+            ).limit(LEADERBOARD_CACHE_SIZE).to_list(LEADERBOARD_CACHE_SIZE)
+            self.rows = rows
+            self.keys = [self.key(row) for row in rows]
+            self.loaded_at = time.monotonic()
+        return self.rows[:limit]
+    
+    def update(self, guild: Dict[str, Any]):
+        """Move one guild to its new position, if the cache is loaded"""
+        if self.loaded_at is None:
+            return
+        was_cached = False
+        for i, row in enumerate(self.rows):
+            if row["id"] == guild["id"]:
+                del self.rows[i]
+                del self.keys[i]
+                was_cached = True
+                break
+        
+        key = self.key(guild)
+        full = len(self.rows) >= LEADERBOARD_CACHE_SIZE - (1 if was_cached else 0)
+        if full and self.keys and key > self.keys[-1]:
+            # Dropped below the cached window; whoever replaces it is unknown
+            if was_cached:
+                self.loaded_at = None
+            return
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.rows.insert(i, {k: guild.get(k) for k in GUILD_ROW_PROJECTION if k != "_id"})
+        del self.rows[LEADERBOARD_CACHE_SIZE:]
+        del self.keys[LEADERBOARD_CACHE_SIZE:]
+    
+    def invalidate(self):
+        self.loaded_at = None
+
+
+GUILD_BOARDS = {
+    "overall": GuildBoard([("level", -1), ("experience", -1)]),
+    "weekly": GuildBoard([("weekly_contribution", -1)]),
+}
+
+
+def _update_guild_boards(guild: Dict[str, Any]):
+    """Patch a guild's new standing into every cached board"""
+    for board in GUILD_BOARDS.values():
+        board.update(guild)
+
+
+def _ranked_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{**row, "rank": i + 1} for i, row in enumerate(rows)]
+
+
+@router.get("/leaderboard")
+async def get_guild_leaderboard(limit: int = 100):
+    """Get top guilds by level and XP"""
+    limit = max(1, min(limit, LEADERBOARD_CACHE_SIZE))
+    return {"leaderboard": _ranked_rows(await GUILD_BOARDS["overall"].top(limit))}
+
+
+@router.get("/leaderboard/weekly")
+async def get_weekly_guild_leaderboard(limit: int = 100):
+    """Get top guilds by this week's contributions"""
+    limit = max(1, min(limit, LEADERBOARD_CACHE_SIZE))
+    return {"leaderboard": _ranked_rows(await GUILD_BOARDS["weekly"].top(limit))}
+
+
+@router.get("/leaderboard/rank/{guild_id}")
+async def get_guild_rank(guild_id: str, board: str = "overall"):
+    """Get one guild's position on the overall or weekly board"""
+    if board not in GUILD_BOARDS:
+        raise HTTPException(status_code=400, detail=f"Board must be one of: {', '.join(GUILD_BOARDS)}")
+    ranking = GUILD_BOARDS[board]
+    
+    for i, row in enumerate(await ranking.top(LEADERBOARD_CACHE_SIZE)):
+        if row["id"] == guild_id:
+            return {"guild_id": guild_id, "board": board, "rank": i + 1}
+    
+    # Outside the cached window - count the guilds ahead of it
+    guild = await db.guilds.find_one({"id": guild_id}, GUILD_ROW_PROJECTION)
+    if not guild:
+        raise HTTPException(status_code=404, detail="Guild not found")
+    ahead = await db.guilds.count_documents(ranking.ahead_filter(guild))
+    return {"guild_id": guild_id, "board": board, "rank": ahead + 1}
+
 
 # ========== GUILD CRUD ENDPOINTS ==========
 
@@ -114,6 +472,7 @@ async def create_guild(request: CreateGuildRequest):
         "id": str(uuid.uuid4()),
         "name": request.name,
         "tag": request.tag.upper(),
+        SEARCH_FIELD: search_terms(request.name, request.tag),
         "description": request.description,
         "icon": request.icon,
         "banner_color": request.banner_color,
@@ -125,7 +484,9 @@ async def create_guild(request: CreateGuildRequest):
         "ranks": DEFAULT_RANKS,
         "perks": GUILD_PERKS[1],
         "treasury": {"coins": 0, "gems": 0},
+        "counter_shards": 0,
         "weekly_contribution": 0,
+        "last_reset_week": _week_key(datetime.now(timezone.utc) - timedelta(days=7)),
         "total_fish_caught": 0,
         "achievements": [],
         "settings": {
@@ -151,25 +512,26 @@ async def create_guild(request: CreateGuildRequest):
     
     await db.guilds.insert_one(guild)
     await db.guild_members.insert_one(leader_member)
+    _update_guild_boards(guild)
     
-    return {"success": True, "guild": {k: v for k, v in guild.items() if k != "_id"}}
+    return {"success": True, "guild": {k: v for k, v in guild.items() if k not in ("_id", SEARCH_FIELD)}}
 
 
 @router.get("/search")
 async def search_guilds(query: str = "", limit: int = 20):
-    """Search for guilds"""
-    if query:
-        guilds = await db.guilds.find({
-            "$or": [
-                {"name": {"$regex": query, "$options": "i"}},
-                {"tag": {"$regex": query, "$options": "i"}}
-            ],
+    """Search for guilds by name or tag prefix"""
+    limit = max(1, min(limit, 50))
+    if query.strip():
+        # Over-fetch a little so exact and whole-name matches can be ranked first
+        candidates = await db.guilds.find({
+            **prefix_filter(query),
             "settings.is_public": True
-        }, {"_id": 0}).limit(limit).to_list(limit)
+        }, {"_id": 0, SEARCH_FIELD: 0}).limit(limit * 3).to_list(limit * 3)
+        guilds = rank_matches(candidates, query, ["name", "tag"], lambda g: -g.get("level", 1))[:limit]
     else:
         guilds = await db.guilds.find(
             {"settings.is_public": True},
-            {"_id": 0}
+            {"_id": 0, SEARCH_FIELD: 0}
         ).sort("level", -1).limit(limit).to_list(limit)
     
     return {"guilds": guilds}
@@ -177,21 +539,36 @@ async def search_guilds(query: str = "", limit: int = 20):
 
 @router.get("/{guild_id}")
 async def get_guild(guild_id: str):
-    """Get guild details"""
-    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0})
+    """Get guild details with the first page of members"""
+    guild = await _with_shard_totals(await db.guilds.find_one({"id": guild_id}, {"_id": 0, SEARCH_FIELD: 0}))
     if not guild:
         raise HTTPException(status_code=404, detail="Guild not found")
     
-    # Get members
-    members = await db.guild_members.find(
-        {"guild_id": guild_id},
-        {"_id": 0}
-    ).sort("contribution_points", -1).to_list(100)
-    
-    guild["members"] = members
+    roster = await _guild_roster(guild_id)
+    guild["members"] = roster[:MEMBER_PAGE_SIZE]
     return guild
 
 
+@router.get("/{guild_id}/members")
+async def get_guild_members(guild_id: str, offset: int = 0, limit: int = MEMBER_PAGE_SIZE):
+    """Get a page of guild members ordered by contribution"""
+    offset = max(offset, 0)
+    limit = max(1, min(limit, 100))
+    roster = await _guild_roster(guild_id)
+    return {
+        "members": roster[offset:offset + limit],
+        "total": len(roster),
+        "offset": offset,
+        "limit": limit
+    }
+
+
+@router.get("/{guild_id}/online")
+async def get_guild_online_count(guild_id: str):
+    """Members seen in the last few minutes, from the in-memory activity tracker"""
+    return {"guild_id": guild_id, "online": activity_tracker.online_count(guild_id)}
+
+
 @router.get("/user/{user_id}")
 async def get_user_guild(user_id: str):
     """Get user's current guild"""
@@ -199,7 +576,9 @@ async def get_user_guild(user_id: str):
     if not membership:
         return {"in_guild": False}
     
-    guild = await db.guilds.find_one({"id": membership["guild_id"]}, {"_id": 0})
+    guild = await _with_shard_totals(
+        await db.guilds.find_one({"id": membership["guild_id"]}, {"_id": 0, SEARCH_FIELD: 0})
+    )
     return {"in_guild": True, "membership": membership, "guild": guild}
 
 
@@ -244,6 +623,7 @@ async def join_guild(guild_id: str, request: JoinGuildRequest):
         }
         await db.guild_members.insert_one(member)
         await db.guilds.update_one({"id": guild_id}, {"$inc": {"member_count": 1}})
+        _invalidate_roster(guild_id)
         return {"success": True, "auto_accepted": True, "membership": {k: v for k, v in member.items() if k != "_id"}}
     
     # Create application
@@ -314,6 +694,7 @@ async def accept_application(guild_id: str, application_id: str, approver_user_i
         {"$set": {"status": "accepted"}}
     )
     await db.guilds.update_one({"id": guild_id}, {"$inc": {"member_count": 1}})
+    _invalidate_roster(guild_id)
     
     return {"success": True, "new_member": {k: v for k, v in member.items() if k != "_id"}}
 
@@ -353,6 +734,7 @@ async def leave_guild(guild_id: str, user_id: str):
     
     await db.guild_members.delete_one({"guild_id": guild_id, "user_id": user_id})
     await db.guilds.update_one({"id": guild_id}, {"$inc": {"member_count": -1}})
+    _invalidate_roster(guild_id)
     
     return {"success": True}
 
@@ -379,6 +761,7 @@ async def kick_member(guild_id: str, request: UpdateMemberRequest, kicker_user_i
     
     await db.guild_members.delete_one({"guild_id": guild_id, "user_id": request.target_user_id})
     await db.guilds.update_one({"id": guild_id}, {"$inc": {"member_count": -1}})
+    _invalidate_roster(guild_id)
     
     return {"success": True}
 
@@ -411,6 +794,7 @@ async def promote_member(guild_id: str, request: UpdateMemberRequest, promoter_u
         {"guild_id": guild_id, "user_id": request.target_user_id},
         {"$set": {"rank": new_rank}}
     )
+    _invalidate_roster(guild_id)
     
     return {"success": True, "new_rank": new_rank}
 
@@ -442,76 +826,142 @@ async def transfer_leadership(guild_id: str, current_leader_id: str, new_leader_
         {"id": guild_id},
         {"$set": {"leader_id": new_leader_id}}
     )
+    _invalidate_roster(guild_id)
     
     return {"success": True}
 
 
 # ========== GUILD CONTRIBUTIONS ==========
 
+@router.post("/{guild_id}/counter-shards")
+async def set_guild_counter_shards(guild_id: str, shards: int):
+    """Turn sharded counters on (shards > 0) or off (0) for a hot guild"""
+    if shards < 0 or shards > MAX_COUNTER_SHARDS:
+        raise HTTPException(status_code=400, detail=f"Shards must be 0-{MAX_COUNTER_SHARDS}")
+    
+    result = await db.guilds.update_one({"id": guild_id}, {"$set": {"counter_shards": shards}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Guild not found")
+    
+    # Going back to a single document, fold what the shards still hold
+    if shards == 0:
+        await compact_guild_counters(guild_id)
+    return {"success": True, "counter_shards": shards}
+
+
+@router.post("/admin/compact-counters")
+async def admin_compact_guild_counters():
+    """Admin endpoint to fold all guild counter shards now"""
+    result = await compact_all_guild_counters()
+    return {"success": True, **result}
+
+
 @router.post("/{guild_id}/contribute")
 async def contribute_to_guild(guild_id: str, request: ContributeRequest):
     """Contribute resources to the guild"""
+    if request.amount <= 0:
+        raise HTTPException(status_code=400, detail="Contribution must be positive")
+    
     membership = await db.guild_members.find_one({
         "guild_id": guild_id,
         "user_id": request.user_id
-    })
+    }, {"_id": 0, "id": 1})
     if not membership:
         raise HTTPException(status_code=404, detail="Not in this guild")
     
-    # Verify user has resources
-    user = await db.users.find_one({"id": request.user_id}, {"_id": 0})
+    # Debit only if the balance still covers the amount at write time
     if request.contribution_type == "coins":
-        if user.get("score", 0) < request.amount:
-            raise HTTPException(status_code=400, detail="Insufficient coins")
-        await db.users.update_one(
-            {"id": request.user_id},
+        debited = await db.users.update_one(
+            {"id": request.user_id, "score": {"$gte": request.amount}},
             {"$inc": {"score": -request.amount}}
         )
+        if debited.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Insufficient coins")
     
     # Update contribution
     contribution_points = request.amount // 10  # 1 point per 10 coins
+    activity_tracker.touch(request.user_id, guild_id)
     
-    await db.guild_members.update_one(
-        {"guild_id": guild_id, "user_id": request.user_id},
-        {
-            "$inc": {"contribution_points": contribution_points},
-            "$set": {"last_active": datetime.now(timezone.utc).isoformat()}
-        }
-    )
+    counters = {
+        f"treasury.{request.contribution_type}": request.amount,
+        "weekly_contribution": request.amount,
+        "experience": contribution_points
+    }
     
-    # Update guild treasury and XP
-    await db.guilds.update_one(
-        {"id": guild_id},
-        {
-            "$inc": {
-                f"treasury.{request.contribution_type}": request.amount,
-                "weekly_contribution": request.amount,
-                "experience": contribution_points
-            }
-        }
+    # Member and guild updates are independent, so send them together.
+    # The guild filter only matches unsharded guilds; sharded ones miss and
+    # take the shard path, with level-ups applied at compaction.
+    _, guild = await asyncio.gather(
+        db.guild_members.update_one(
+            {"guild_id": guild_id, "user_id": request.user_id},
+            {"$inc": {"contribution_points": contribution_points}}
+        ),
+        db.guilds.find_one_and_update(
+            {"id": guild_id, "counter_shards": {"$in": [None, 0]}},
+            {"$inc": counters},
+            projection=LEVEL_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
     )
+    _invalidate_roster(guild_id)
     
     # Check for level up
-    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0})
-    xp_for_next_level = guild["level"] * 1000
-    if guild["experience"] >= xp_for_next_level and guild["level"] < 10:
-        new_level = guild["level"] + 1
-        new_perks = GUILD_PERKS.get(new_level, [])
-        new_max_members = 30 + (new_level - 1) * 5
-        
-        await db.guilds.update_one(
-            {"id": guild_id},
+    levels_gained = 0
+    if guild:
+        guild, levels_gained = await _apply_level_ups(guild_id, guild)
+        _update_guild_boards(guild)
+    else:
+        sharded = await db.guilds.find_one({"id": guild_id}, {"_id": 0, "counter_shards": 1, **LEVEL_PROJECTION})
+        if sharded:
+            await _increment_guild_counters(guild_id, sharded["counter_shards"], counters)
+            guild = sharded
+    
+    return {
+        "success": True,
+        "contribution_points": contribution_points,
+        "guild_level": guild["level"] if guild else None,
+        "levels_gained": levels_gained
+    }
+
+
+# Carries the leaderboard row so level changes can patch the cached boards
+LEVEL_PROJECTION = GUILD_ROW_PROJECTION
+
+
+def _xp_for_next_level(level: int) -> int:
+    return level * 1000
+
+
+async def _apply_level_ups(guild_id: str, guild: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Level the guild up as many times as its XP allows"""
+    # Each step is conditional on its starting level, so concurrent
+    # contributors never apply the same level-up twice or skip one
+    levels_gained = 0
+    while guild["level"] < GUILD_MAX_LEVEL and guild["experience"] >= _xp_for_next_level(guild["level"]):
+        level = guild["level"]
+        new_level = level + 1
+        updated = await db.guilds.find_one_and_update(
+            {"id": guild_id, "level": level, "experience": {"$gte": _xp_for_next_level(level)}},
             {
                 "$set": {
                     "level": new_level,
-                    "perks": new_perks,
-                    "max_members": new_max_members
+                    "perks": GUILD_PERKS.get(new_level, []),
+                    "max_members": 30 + (new_level - 1) * 5
                 },
-                "$inc": {"experience": -xp_for_next_level}
-            }
+                "$inc": {"experience": -_xp_for_next_level(level)}
+            },
+            projection=LEVEL_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
-    
-    return {"success": True, "contribution_points": contribution_points}
+        if updated is None:
+            # Someone else applied this level-up first; continue from the current state
+            updated = await db.guilds.find_one({"id": guild_id}, LEVEL_PROJECTION)
+            if updated is None:
+                break
+        else:
+            levels_gained += 1
+        guild = updated
+    return guild, levels_gained
 
 
 # ========== GUILD CHALLENGES ==========
@@ -523,7 +973,9 @@ async def create_guild_challenge(request: GuildChallengeRequest):
     if not challenger_membership or challenger_membership["rank"] not in ["leader", "co-leader"]:
         raise HTTPException(status_code=403, detail="Must be leader or co-leader to start challenges")
     
-    challenger_guild = await db.guilds.find_one({"id": challenger_membership["guild_id"]}, {"_id": 0})
+    challenger_guild = await _with_shard_totals(
+        await db.guilds.find_one({"id": challenger_membership["guild_id"]}, {"_id": 0})
+    )
     defender_guild = await db.guilds.find_one({"id": request.defender_guild_id}, {"_id": 0})
     
     if not defender_guild:
@@ -573,26 +1025,12 @@ async def accept_guild_challenge(challenge_id: str, accepter_user_id: str):
     if not membership or membership["rank"] not in ["leader", "co-leader"]:
         raise HTTPException(status_code=403, detail="Must be leader or co-leader to accept")
     
-    # Check defender has stake
-    if challenge["stake"].get("coins", 0) > 0:
-        defender_guild = await db.guilds.find_one({"id": challenge["defender_guild_id"]}, {"_id": 0})
-        if defender_guild["treasury"].get("coins", 0) < challenge["stake"]["coins"]:
-            raise HTTPException(status_code=400, detail="Insufficient guild treasury for stake")
-        
-        # Deduct stakes
-        await db.guilds.update_one(
-            {"id": challenge["defender_guild_id"]},
-            {"$inc": {"treasury.coins": -challenge["stake"]["coins"]}}
-        )
-        await db.guilds.update_one(
-            {"id": challenge["challenger_guild_id"]},
-            {"$inc": {"treasury.coins": -challenge["stake"]["coins"]}}
-        )
-    
     end_time = datetime.now(timezone.utc) + timedelta(hours=challenge["duration_hours"])
     
-    await db.guild_challenges.update_one(
-        {"id": challenge_id},
+    # Claim the pending -> active transition first, so a double accept
+    # can't take the stakes twice
+    claimed = await db.guild_challenges.update_one(
+        {"id": challenge_id, "status": "pending", "expires_at": {"$gt": datetime.now(timezone.utc).isoformat()}},
         {
             "$set": {
                 "status": "active",
@@ -601,6 +1039,27 @@ async def accept_guild_challenge(challenge_id: str, accepter_user_id: str):
             }
         }
     )
+    if claimed.modified_count == 0:
+        raise HTTPException(status_code=404, detail="Challenge not found, not pending or expired")
+    
+    # Deduct stakes, each guarded on the treasury covering it
+    stake = challenge["stake"].get("coins", 0)
+    if stake > 0:
+        error = None
+        if not await _debit_treasury(challenge["defender_guild_id"], stake):
+            error = "Insufficient guild treasury for stake"
+        elif not await _debit_treasury(challenge["challenger_guild_id"], stake):
+            await db.guilds.update_one(
+                {"id": challenge["defender_guild_id"]},
+                {"$inc": {"treasury.coins": stake}}
+            )
+            error = "Challenger guild can no longer cover the stake"
+        if error:
+            await db.guild_challenges.update_one(
+                {"id": challenge_id, "status": "active"},
+                {"$set": {"status": "pending"}, "$unset": {"started_at": "", "ends_at": ""}}
+            )
+            raise HTTPException(status_code=400, detail=error)
     
     return {"success": True}
 
@@ -619,10 +1078,76 @@ async def get_active_challenges(guild_id: str):
     return {"challenges": challenges}
 
 
+# Biggest-fish challenges keep the best size seen; the others accumulate
+CHALLENGE_PROGRESS_OPS = {"biggest_fish": "$max"}
+
+
+def _progress_pipeline(guild_id: str, operator: str, value: int) -> List[Dict[str, Any]]:
+    """Update pipeline applying a progress value to whichever side the guild is on"""
+    def side(field: str, guild_field: str) -> Dict[str, Any]:
+        return {"$cond": [
+            {"$eq": [f"${guild_field}", guild_id]},
+            {operator: [f"${field}", value]},
+            f"${field}"
+        ]}
+    return [{"$set": {
+        "challenger_progress": side("challenger_progress", "challenger_guild_id"),
+        "defender_progress": side("defender_progress", "defender_guild_id")
+    }}]
+
+
+def _challenge_sides(guild_id: str) -> Dict[str, Any]:
+    return {"$or": [{"challenger_guild_id": guild_id}, {"defender_guild_id": guild_id}]}
+
+
+async def _complete_challenge(challenge_id: str) -> Optional[Dict[str, Any]]:
+    """Move a challenge whose target was reached from active to completed and pay the winner"""
+    # Conditional on still being active, so only one caller ever wins the
+    # transition and pays out; the winner is decided from the stored progress
+    challenge_won = {"$or": [
+        {"$gte": ["$challenger_progress", "$target"]},
+        {"$gte": ["$defender_progress", "$target"]}
+    ]}
+    challenger_wins = {"$and": [
+        {"$gte": ["$challenger_progress", "$target"]},
+        {"$or": [
+            {"$lt": ["$defender_progress", "$target"]},
+            {"$gt": ["$challenger_progress", "$defender_progress"]}
+        ]}
+    ]}
+    completed = await db.guild_challenges.find_one_and_update(
+        {"id": challenge_id, "status": "active", "$expr": challenge_won},
+        [{"$set": {
+            "status": "completed",
+            "winner_guild_id": {"$cond": [challenger_wins, "$challenger_guild_id", "$defender_guild_id"]},
+            "completed_at": datetime.now(timezone.utc).isoformat()
+        }}],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not completed:
+        return None
+    
+    # Award stake to winner
+    total_stake = completed["stake"].get("coins", 0) * 2
+    if total_stake > 0:
+        winner = completed["winner_guild_id"]
+        winner_guild = await db.guilds.find_one({"id": winner}, {"_id": 0, "counter_shards": 1})
+        await _increment_guild_counters(
+            winner,
+            (winner_guild or {}).get("counter_shards", 0),
+            {"treasury.coins": total_stake}
+        )
+    return completed
+
+
 @router.post("/challenges/{challenge_id}/update-progress")
 async def update_challenge_progress(challenge_id: str, guild_id: str, progress_delta: int):
     """Update guild's challenge progress"""
-    challenge = await db.guild_challenges.find_one({"id": challenge_id, "status": "active"}, {"_id": 0})
+    challenge = await db.guild_challenges.find_one(
+        {"id": challenge_id, "status": "active"},
+        {"_id": 0, "challenger_guild_id": 1, "defender_guild_id": 1}
+    )
     if not challenge:
         raise HTTPException(status_code=404, detail="Active challenge not found")
     
@@ -633,43 +1158,187 @@ async def update_challenge_progress(challenge_id: str, guild_id: str, progress_d
     else:
         raise HTTPException(status_code=400, detail="Guild not part of this challenge")
     
-    await db.guild_challenges.update_one(
-        {"id": challenge_id},
-        {"$inc": {field: progress_delta}}
+    updated = await db.guild_challenges.find_one_and_update(
+        {"id": challenge_id, "status": "active"},
+        {"$inc": {field: progress_delta}},
+        projection={"_id": 0, "challenger_progress": 1, "defender_progress": 1, "target": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Active challenge not found")
     
     # Check for completion
-    updated = await db.guild_challenges.find_one({"id": challenge_id}, {"_id": 0})
-    if updated["challenger_progress"] >= challenge["target"] or updated["defender_progress"] >= challenge["target"]:
-        # Determine winner
-        winner = None
-        if updated["challenger_progress"] >= challenge["target"] and updated["defender_progress"] >= challenge["target"]:
-            # Both reached target, higher wins
-            winner = challenge["challenger_guild_id"] if updated["challenger_progress"] > updated["defender_progress"] else challenge["defender_guild_id"]
-        elif updated["challenger_progress"] >= challenge["target"]:
-            winner = challenge["challenger_guild_id"]
-        elif updated["defender_progress"] >= challenge["target"]:
-            winner = challenge["defender_guild_id"]
-        
-        if winner:
-            # Award stake to winner
-            total_stake = challenge["stake"].get("coins", 0) * 2
-            if total_stake > 0:
-                await db.guilds.update_one(
-                    {"id": winner},
-                    {"$inc": {"treasury.coins": total_stake}}
-                )
-            
-            await db.guild_challenges.update_one(
-                {"id": challenge_id},
-                {"$set": {"status": "completed", "winner_guild_id": winner}}
-            )
-    
-    return {"success": True, "current_progress": updated[field]}
+    completed = None
+    if max(updated["challenger_progress"], updated["defender_progress"]) >= updated["target"]:
+        completed = await _complete_challenge(challenge_id)
+    
+    return {
+        "success": True,
+        "current_progress": updated[field],
+        "completed": completed is not None,
+        "winner_guild_id": completed["winner_guild_id"] if completed else None
+    }
+
+
+@router.post("/challenges/catch-event")
+async def record_challenge_catch(event: ChallengeCatchEvent):
+    """Apply one catch to every active challenge of the guild in a single batch"""
+    values = {
+        "fish_count": event.fish_count,
+        "total_score": event.score,
+        "biggest_fish": event.fish_size,
+    }
+    now = datetime.now(timezone.utc).isoformat()
+    updates = [
+        UpdateMany(
+            {"status": "active", "challenge_type": challenge_type, "ends_at": {"$gt": now},
+             **_challenge_sides(event.guild_id)},
+            _progress_pipeline(event.guild_id, "$max" if challenge_type in CHALLENGE_PROGRESS_OPS else "$add", value)
+        )
+        for challenge_type, value in values.items() if value > 0
+    ]
+    if not updates:
+        return {"success": True, "updated": 0, "completed": []}
+    
+    result = await db.guild_challenges.bulk_write(updates, ordered=False)
+    
+    # Only challenges that just reached their target need the completion step
+    reached = await db.guild_challenges.find(
+        {"status": "active", **_challenge_sides(event.guild_id), "$expr": {"$or": [
+            {"$gte": ["$challenger_progress", "$target"]},
+            {"$gte": ["$defender_progress", "$target"]}
+        ]}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    completed = []
+    for challenge in reached:
+        done = await _complete_challenge(challenge["id"])
+        if done:
+            completed.append({"challenge_id": done["id"], "winner_guild_id": done["winner_guild_id"]})
+    
+    return {"success": True, "updated": result.modified_count, "completed": completed}
 
 
 # ========== GUILD CHAT ==========
 
+# Each worker keeps the last CHAT_HISTORY_SIZE messages of every channel it has
+# served recently, kept current through the pub/sub transport, so joiners and
+# polls get history without a database read. Channels with no listeners are
+# dropped after CHAT_CHANNEL_IDLE_SECONDS. Messages are persisted in batches.
+
+CHAT_HISTORY_SIZE = 100
+CHAT_FLUSH_SECONDS = 1.0
+CHAT_FLUSH_BATCH = 200
+CHAT_BUFFER_LIMIT = 50 * CHAT_FLUSH_BATCH  # unwritten messages kept while the database is down
+CHAT_SUBSCRIBER_QUEUE_SIZE = 64
+CHAT_CHANNEL_IDLE_SECONDS = 600
+CHAT_EVICTION_INTERVAL_SECONDS = 60
+
+
+class ChatChannel:
+    """Ring buffer and live subscribers for one chat channel"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.history: deque = deque(maxlen=CHAT_HISTORY_SIZE)
+        self.subscribers: set = set()
+        self.warmed = asyncio.Event()
+        self.last_used = time.monotonic()
+        self.unsubscribe = get_pubsub().subscribe(name, self._deliver)
+    
+    async def warm(self):
+        # Subscribed before reading, so anything published meanwhile is
+        # already in the buffer; merge it, and messages not yet flushed
+        # (a channel reopened after eviction), with the stored ones
+        stored = await read_messages(db, self.name, CHAT_HISTORY_SIZE)
+        merged = {m["id"]: m for m in stored}
+        for m in _chat_write_buffer + list(self.history):
+            if m["channel"] == self.name:
+                merged.setdefault(m["id"], m)
+        self.history.clear()
+        self.history.extend(sorted(merged.values(), key=lambda m: m["created_at"]))
+        self.warmed.set()
+    
+    def _deliver(self, message: Dict[str, Any]):
+        self.history.append(message)
+        frame = format_sse("message", message, event_id=message["id"])
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(frame):
+                self.subscribers.discard(subscriber)
+    
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        return list(self.history)[-limit:] if limit > 0 else []
+
+
+_chat_channels: Dict[str, ChatChannel] = {}
+_chat_write_buffer: List[Dict[str, Any]] = []
+
+
+async def _chat_channel(name: str) -> ChatChannel:
+    """Get a channel's hub, loading its recent history the first time"""
+    channel = _chat_channels.get(name)
+    if channel is None:
+        channel = _chat_channels[name] = ChatChannel(name)
+        try:
+            await channel.warm()
+        except Exception:
+            channel.unsubscribe()
+            del _chat_channels[name]
+            channel.warmed.set()  # release concurrent callers waiting on this load
+            raise
+    else:
+        await channel.warmed.wait()
+        if _chat_channels.get(name) is not channel:
+            # The load we waited on failed, or the channel was evicted - start over
+            return await _chat_channel(name)
+    channel.last_used = time.monotonic()
+    return channel
+
+
+def _evict_idle_chat_channels():
+    """Drop channels without listeners that nobody has used for a while"""
+    cutoff = time.monotonic() - CHAT_CHANNEL_IDLE_SECONDS
+    for name, channel in list(_chat_channels.items()):
+        if channel.warmed.is_set() and not channel.subscribers and channel.last_used < cutoff:
+            channel.unsubscribe()
+            del _chat_channels[name]
+
+
+async def _flush_chat_writes():
+    """Write buffered chat messages in one batch; failed ones go back to the front"""
+    if not _chat_write_buffer:
+        return
+    batch = _chat_write_buffer[:]
+    del _chat_write_buffer[:]
+    try:
+        # Copies - insert_many adds _id, and the originals live in the ring buffers
+        unwritten = await store_messages(db, [dict(m) for m in batch])
+    except Exception as e:
+        logger.error(f"Guild chat flush failed: {e}")
+        unwritten = batch
+    if not unwritten:
+        return
+    
+    failed_ids = {m["id"] for m in unwritten}
+    retry = [m for m in batch if m["id"] in failed_ids]
+    _chat_write_buffer[:0] = retry
+    overflow = len(_chat_write_buffer) - CHAT_BUFFER_LIMIT
+    if overflow > 0:
+        del _chat_write_buffer[:overflow]
+        logger.error(f"Guild chat buffer full, dropped {overflow} oldest messages")
+    logger.warning(f"Requeued {len(retry)} guild chat messages for the next flush")
+
+
+async def _chat_writer_loop():
+    last_eviction = time.monotonic()
+    while True:
+        await asyncio.sleep(CHAT_FLUSH_SECONDS)
+        await _flush_chat_writes()
+        if time.monotonic() - last_eviction >= CHAT_EVICTION_INTERVAL_SECONDS:
+            _evict_idle_chat_channels()
+            last_eviction = time.monotonic()
+
+
 @router.post("/{guild_id}/chat")
 async def send_guild_chat(guild_id: str, request: GuildChatRequest):
     """Send a message to guild chat"""
@@ -691,57 +1360,273 @@ async def send_guild_chat(guild_id: str, request: GuildChatRequest):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.chat_messages.insert_one(message)
-    
-    # Update last active
-    await db.guild_members.update_one(
-        {"guild_id": guild_id, "user_id": request.user_id},
-        {"$set": {"last_active": datetime.now(timezone.utc).isoformat()}}
-    )
+    await _chat_channel(message["channel"])
+    _chat_write_buffer.append(message)
+    if len(_chat_write_buffer) >= CHAT_FLUSH_BATCH:
+        await _flush_chat_writes()
+    await get_pubsub().publish(message["channel"], message)
+    activity_tracker.touch(request.user_id, guild_id)
     
-    return {"success": True, "message": {k: v for k, v in message.items() if k != "_id"}}
+    return {"success": True, "message": message}
 
 
 @router.get("/{guild_id}/chat")
 async def get_guild_chat(guild_id: str, limit: int = 50, before: str = None):
     """Get guild chat messages"""
-    query = {"channel": f"guild_{guild_id}"}
-    if before:
-        query["created_at"] = {"$lt": before}
+    channel_name = f"guild_{guild_id}"
+    if not before and limit <= CHAT_HISTORY_SIZE:
+        channel = await _chat_channel(channel_name)
+        return {"messages": channel.recent(limit)}
     
-    messages = await db.chat_messages.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
-    
-    return {"messages": list(reversed(messages))}
+    return {"messages": await read_messages(db, channel_name, limit, before)}
 
 
-# ========== GUILD LEADERBOARD ==========
+@router.post("/admin/migrate-chat")
+async def admin_migrate_chat():
+    """Admin endpoint to move per-message chat documents into buckets"""
+    if not bucket_mode():
+        raise HTTPException(status_code=400, detail="Set CHAT_STORAGE_MODE=bucket before migrating")
+    await ensure_chat_indexes(db)
+    result = await migrate_to_buckets(db)
+    return {"success": True, **result}
 
-@router.get("/leaderboard")
-async def get_guild_leaderboard(limit: int = 100):
-    """Get top guilds by level and XP"""
-    guilds = await db.guilds.find(
-        {},
-        {"_id": 0, "id": 1, "name": 1, "tag": 1, "icon": 1, "level": 1, "experience": 1, "member_count": 1, "total_fish_caught": 1}
-    ).sort([("level", -1), ("experience", -1)]).limit(limit).to_list(limit)
+
+@router.post("/{guild_id}/announce")
+async def announce_to_guild(guild_id: str, request: GuildAnnouncementRequest):
+    """Send a notification to every guild member (leader or co-leader only)"""
+    membership = await db.guild_members.find_one(
+        {"guild_id": guild_id, "user_id": request.user_id},
+        {"_id": 0, "rank": 1}
+    )
+    if not membership or membership["rank"] not in ["leader", "co-leader"]:
+        raise HTTPException(status_code=403, detail="Must be leader or co-leader to announce")
     
-    for i, guild in enumerate(guilds):
-        guild["rank"] = i + 1
+    guild = await db.guilds.find_one({"id": guild_id}, {"_id": 0, "name": 1, "tag": 1})
+    if not guild:
+        raise HTTPException(status_code=404, detail="Guild not found")
     
-    return {"leaderboard": guilds}
+    queued = dispatcher.dispatch(
+        db,
+        {
+            "notification_type": "guild",
+            "category": "guild",
+            "title": "[{guild_tag}] {announcement_title}",
+            "message": "{announcement}",
+            "icon": "📣",
+            "action_type": "open_guild",
+            "action_data": {"guild_id": guild_id}
+        },
+        query={
+            "collection": "guild_members",
+            "filter": {"guild_id": guild_id, "user_id": {"$ne": request.user_id}}
+        },
+        # Player-written text goes in as values, never as part of the template
+        context={
+            "guild_tag": guild["tag"],
+            "announcement_title": request.title[:80],
+            "announcement": request.message[:500]
+        }
+    )
+    if not queued:
+        raise HTTPException(status_code=503, detail="Notifications are busy, try again shortly")
+    return {"success": True}
+
+
+@router.get("/{guild_id}/chat/stream")
+async def stream_guild_chat(guild_id: str, user_id: str):
+    """Stream guild chat: recent history first, then each new message"""
+    membership = await db.guild_members.find_one(
+        {"guild_id": guild_id, "user_id": user_id},
+        {"_id": 0, "id": 1}
+    )
+    if not membership:
+        raise HTTPException(status_code=403, detail="Not a member of this guild")
+    
+    activity_tracker.touch(user_id, guild_id)
+    channel = await _chat_channel(f"guild_{guild_id}")
+    subscriber = Subscriber(CHAT_SUBSCRIBER_QUEUE_SIZE)
+    subscriber.offer(format_sse("history", {"messages": channel.recent(CHAT_HISTORY_SIZE)}))
+    channel.subscribers.add(subscriber)
+    
+    return StreamingResponse(
+        sse_stream(subscriber, lambda: channel.subscribers.discard(subscriber)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 
+# ========== GUILD MEMBER LEADERBOARD ==========
 
 @router.get("/{guild_id}/leaderboard")
 async def get_guild_member_leaderboard(guild_id: str):
     """Get member contribution leaderboard"""
+    roster = await _guild_roster(guild_id)
+    
+    # Copies, so the cached roster keeps each member's guild rank
+    members = [{**member, "rank": i + 1, "guild_rank": member["rank"]} for i, member in enumerate(roster)]
+    
+    return {"leaderboard": members}
+
+
+# ========== WEEKLY RESET & INACTIVITY ==========
+
+# Runs once per ISO week (Mondays UTC). The job_runs record holds a lease, so
+# only one worker runs the steps at a time; a second trigger is a no-op and a
+# run whose lease expired is resumed at the step it reached. The reset stamps
+# each guild with the week it closed, so it never moves a guild's totals twice.
+
+INACTIVE_AFTER_DAYS = 7
+WEEKLY_JOB_CHECK_SECONDS = 3600
+WEEKLY_JOB_LEASE_SECONDS = 600
+
+
+def _week_key(when: datetime) -> str:
+    year, week, _ = when.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+async def run_weekly_guild_job(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Snapshot and reset weekly contributions, then refresh member inactivity flags"""
+    now = now or datetime.now(timezone.utc)
+    job_id = f"guild_weekly:{_week_key(now)}"
+    finished_week = _week_key(now - timedelta(days=7))
+    owner = str(uuid.uuid4())
+    
+    def lease_until() -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=WEEKLY_JOB_LEASE_SECONDS)).isoformat()
+    
+    try:
+        await db.job_runs.insert_one({
+            "id": job_id, "status": "running", "steps": [], "started_at": now.isoformat(),
+            "owner": owner, "lease_until": lease_until()
+        })
+        run = {"steps": []}
+    except DuplicateKeyError:
+        # Take over only a run whose holder stopped renewing its lease
+        run = await db.job_runs.find_one_and_update(
+            {"id": job_id, "status": "running", "lease_until": {"$lt": datetime.now(timezone.utc).isoformat()}},
+            {"$set": {"owner": owner, "lease_until": lease_until()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if run is None:
+            existing = await db.job_runs.find_one({"id": job_id}, {"_id": 0})
+            if existing and existing["status"] == "completed":
+                return {"job_id": job_id, "already_ran": True, **existing.get("report", {})}
+            return {"job_id": job_id, "already_ran": False, "in_progress": True}
+    
+    report: Dict[str, Any] = {}
+    
+    async def step_done(step: str) -> bool:
+        """Record a finished step and renew the lease; False if another worker took it over"""
+        result = await db.job_runs.update_one(
+            {"id": job_id, "owner": owner},
+            {"$push": {"steps": step}, "$set": {"lease_until": lease_until()}}
+        )
+        return result.modified_count > 0
+    
+    lost_lease = {"job_id": job_id, "already_ran": False, "in_progress": True}
+    
+    if "reset" not in run["steps"]:
+        # Fold sharded counters so the week's totals live on the guild documents
+        await compact_all_guild_counters()
+        # Move-and-zero in one pipeline update, so a contribution can't land
+        # between the snapshot and the reset and vanish. The week stamp is set
+        # in the same update: a retry skips guilds already reset this week
+        result = await db.guilds.update_many(
+            {
+                "last_reset_week": {"$ne": finished_week},
+                "$or": [{"weekly_contribution": {"$ne": 0}}, {"last_week_contribution": {"$ne": 0}}]
+            },
+            [{"$set": {
+                "last_week_contribution": "$weekly_contribution",
+                "weekly_contribution": 0,
+                "last_reset_week": finished_week
+            }}]
+        )
+        report["guilds_reset"] = result.modified_count
+        GUILD_BOARDS["weekly"].invalidate()
+        if not await step_done("reset"):
+            return lost_lease
+    
+    if "snapshot" not in run["steps"]:
+        await db.guilds.aggregate([
+            {"$match": {"last_week_contribution": {"$gt": 0}}},
+            {"$project": {
+                "_id": {"$concat": ["$id", ":", finished_week]},
+                "guild_id": "$id",
+                "week": finished_week,
+                "weekly_contribution": "$last_week_contribution",
+                "level": 1,
+                "experience": 1,
+                "member_count": 1,
+                "recorded_at": now.isoformat()
+            }},
+            {"$merge": {"into": "guild_weekly_history", "on": "_id", "whenMatched": "replace"}}
+        ]).to_list(None)
+        report["history_rows"] = await db.guild_weekly_history.count_documents({"week": finished_week})
+        if not await step_done("snapshot"):
+            return lost_lease
+    
+    if "inactivity" not in run["steps"]:
+        cutoff = (now - timedelta(days=INACTIVE_AFTER_DAYS)).isoformat()
+        # Flags for every member computed server-side in one pipeline update
+        result = await db.guild_members.update_many(
+            {},
+            [{"$set": {"inactive": {"$lt": [{"$ifNull": ["$last_active", ""]}, cutoff]}}}]
+        )
+        report["members_flag_changes"] = result.modified_count
+        report["members_inactive"] = await db.guild_members.count_documents({"inactive": True})
+        if not await step_done("inactivity"):
+            return lost_lease
+    
+    await db.job_runs.update_one(
+        {"id": job_id, "owner": owner},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat(), "report": report}}
+    )
+    return {"job_id": job_id, "already_ran": False, **report}
+
+
+async def _weekly_reset_loop():
+    while True:
+        try:
+            # Only on Mondays, so a mid-week deploy doesn't reset a week early
+            now = datetime.now(timezone.utc)
+            if now.isoweekday() == 1:
+                done = await db.job_runs.find_one({"id": f"guild_weekly:{_week_key(now)}", "status": "completed"}, {"_id": 1})
+                if not done:
+                    await run_weekly_guild_job(now)
+        except Exception as e:
+            logger.error(f"Weekly guild job failed: {e}")
+        await asyncio.sleep(WEEKLY_JOB_CHECK_SECONDS)
+
+
+@router.post("/admin/weekly-reset")
+async def admin_weekly_reset():
+    """Admin endpoint to run this week's guild reset (no-op if it already ran)"""
+    result = await run_weekly_guild_job()
+    return {"success": True, **result}
+
+
+@router.get("/{guild_id}/members/inactive")
+async def get_inactive_members(guild_id: str, limit: int = 50):
+    """Members flagged inactive by the weekly job, longest-inactive first"""
+    limit = max(1, min(limit, 100))
     members = await db.guild_members.find(
+        {"guild_id": guild_id, "inactive": True},
+        ROSTER_PROJECTION
+    ).sort("last_active", 1).limit(limit).to_list(limit)
+    
+    return {"members": members, "inactive_after_days": INACTIVE_AFTER_DAYS}
+
+
+@router.get("/{guild_id}/weekly-history")
+async def get_guild_weekly_history(guild_id: str, weeks: int = 12):
+    """Weekly contribution totals recorded by the weekly reset"""
+    weeks = max(1, min(weeks, 52))
+    history = await db.guild_weekly_history.find(
         {"guild_id": guild_id},
         {"_id": 0}
-    ).sort("contribution_points", -1).to_list(100)
-    
-    for i, member in enumerate(members):
-        member["rank"] = i + 1
+    ).sort("week", -1).limit(weeks).to_list(weeks)
     
-    return {"leaderboard": members}
+    return {"history": history}
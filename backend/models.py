@@ -28,6 +28,8 @@ class Tournament(BaseModel):
     entry_fee: int = 0
     entry_currency: str = "coins"  # coins, gems, tickets
     max_participants: int = 1000
+    bracket_size: Optional[int] = None  # bracketed leagues rank each bracket independently
+    bracket_skill: str = "level"  # level, high_score
     current_participants: int = 0
     status: str = "upcoming"  # upcoming, active, ended, cancelled
     rules: Dict[str, Any] = Field(default_factory=dict)
@@ -44,11 +46,15 @@ class TournamentEntry(BaseModel):
     tournament_id: str
     user_id: str
     username: str
+    bracket_id: Optional[str] = None
     score: int = 0
     fish_caught: int = 0
     biggest_fish: int = 0
     perfect_catches: int = 0
     combo_max: int = 0
+    max_stage: Optional[int] = None
+    quarantined: bool = False  # set by the score audit, excluded from payouts
+    audit_flags: List[str] = Field(default_factory=list)
     joined_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     last_updated: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -81,6 +87,7 @@ class GuildMember(BaseModel):
     fish_donated: int = 0
     joined_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     last_active: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    inactive: bool = False  # set by the weekly guild job
 
 
 class Guild(BaseModel):
@@ -99,7 +106,10 @@ class Guild(BaseModel):
     ranks: List[GuildRank] = Field(default_factory=list)
     perks: List[str] = Field(default_factory=list)
     treasury: Dict[str, int] = Field(default_factory=lambda: {"coins": 0, "gems": 0})
+    counter_shards: int = 0  # > 0 spreads counter increments across shard documents
     weekly_contribution: int = 0
+    last_week_contribution: int = 0
+    last_reset_week: Optional[str] = None  # ISO week whose totals were moved to last_week_contribution
     total_fish_caught: int = 0
     achievements: List[str] = Field(default_factory=list)
     settings: Dict[str, Any] = Field(default_factory=lambda: {
@@ -145,14 +155,17 @@ class FriendRequest(BaseModel):
     from_user_id: str
     from_username: str
     to_user_id: str
+    pair_key: str = ""  # sorted "id:id", unique while pending
     message: str = ""
-    status: str = "pending"  # pending, accepted, rejected
+    status: str = "pending"  # pending, accepted, rejected, superseded
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 
 class Friendship(BaseModel):
     """Friendship relationship"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    pair_key: str = ""  # sorted "id:id", unique
+    members: List[str] = Field(default_factory=list)
     user_id_1: str
     user_id_2: str
     friendship_level: int = 1
@@ -464,6 +477,8 @@ class Notification(BaseModel):
     action_type: Optional[str] = None  # navigate, claim, open_shop, etc.
     action_data: Optional[Dict[str, Any]] = None
     is_read: bool = False
+    read_at: Optional[datetime] = None  # BSON date; read notifications expire via TTL index
+    silent: bool = False  # sent during quiet hours: inbox only, no live push
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     expires_at: Optional[str] = None
 
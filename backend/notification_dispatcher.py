@@ -0,0 +1,237 @@
+# ========== GO FISH! NOTIFICATION DISPATCHER ==========
+# Bulk notification fan-out off the request path: recipients are streamed from
+# a list or a query, filtered by NotificationPreferences and written in chunks
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+import asyncio
+import logging
+import uuid
+
+from realtime import publish_to_user
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_CHUNK_SIZE = 1000
+DISPATCH_QUEUE_SIZE = 1000
+
+# Notification category -> NotificationPreferences toggle
+CATEGORY_PREFERENCES = {
+    "tournament": "tournament_alerts",
+    "guild": "guild_alerts",
+    "gift": "gift_alerts",
+    "daily": "daily_reminder",
+    "energy": "energy_full_alert",
+}
+
+# What a player without a stored notification_preferences document gets
+PREFERENCE_DEFAULTS = {
+    "push_enabled": True,
+    "email_enabled": False,
+    "tournament_alerts": True,
+    "guild_alerts": True,
+    "gift_alerts": True,
+    "daily_reminder": True,
+    "energy_full_alert": True,
+    "quiet_hours_start": None,
+    "quiet_hours_end": None,
+}
+
+
+class _SafeContext(dict):
+    """Leaves unknown {placeholders} in place instead of failing the whole batch"""
+    
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def render(template: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, str]:
+    """Fill a server-written template; player-written text must come in as a context value"""
+    values = _SafeContext(context)
+    return {
+        "title": template["title"].format_map(values),
+        "message": template["message"].format_map(values),
+    }
+
+
+def in_quiet_hours(preferences: Dict[str, Any], hour: int) -> bool:
+    """Quiet hours are UTC hours and may wrap past midnight (e.g. 22 -> 7)"""
+    start = preferences.get("quiet_hours_start")
+    end = preferences.get("quiet_hours_end")
+    if start is None or end is None or start == end:
+        return False
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+async def load_preferences(db, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Each user's notification preferences, defaults filled in"""
+    stored = {
+        p["user_id"]: p
+        async for p in db.notification_preferences.find({"user_id": {"$in": user_ids}}, {"_id": 0})
+    }
+    return {user_id: {**PREFERENCE_DEFAULTS, **stored.get(user_id, {}), "user_id": user_id} for user_id in user_ids}
+
+
+def category_enabled(preferences: Dict[str, Any], category: Optional[str]) -> bool:
+    toggle = CATEGORY_PREFERENCES.get(category)
+    return not toggle or preferences.get(toggle, True)
+
+
+def is_silent(preferences: Dict[str, Any], hour: int) -> bool:
+    """Inbox only, no live push: push turned off, or inside quiet hours"""
+    return not preferences.get("push_enabled", True) or in_quiet_hours(preferences, hour)
+
+
+async def recount_unread(db, user_ids: List[str]):
+    """Set these players' unread counters from their stored notifications"""
+    counts = {
+        row["_id"]: row["unread"]
+        async for row in db.notifications.aggregate([
+            {"$match": {"user_id": {"$in": user_ids}, "is_read": False}},
+            {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+        ])
+    }
+    await db.notification_counters.bulk_write([
+        UpdateOne({"user_id": user_id}, {"$set": {"unread": counts.get(user_id, 0)}}, upsert=True)
+        for user_id in set(user_ids)
+    ], ordered=False)
+
+
+class NotificationDispatcher:
+    """Queue of fan-out jobs drained by one background worker"""
+    
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(DISPATCH_QUEUE_SIZE)
+        self.worker: Optional[asyncio.Task] = None
+    
+    def dispatch(self, db, template: Dict[str, Any], user_ids: Optional[Iterable[str]] = None,
+                 query: Optional[Dict[str, Any]] = None, context: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a templated notification for a list of users or a recipient query"""
+        # query: {"collection": name, "filter": {...}, "user_field": "user_id", "fields": [...]};
+        # the listed fields of each recipient document are available to the template
+        job = {
+            "db": db,
+            "template": template,
+            "user_ids": list(user_ids) if user_ids is not None else None,
+            "query": query,
+            "context": context or {},
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.error(f"Notification queue full, dropped '{template.get('title')}'")
+            return False
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        return True
+    
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                sent = await self.deliver(**job)
+                logger.info(f"Dispatched '{job['template'].get('title')}' to {sent} players")
+            except Exception as e:
+                logger.error(f"Notification dispatch failed: {e}")
+    
+    async def deliver(self, db, template: Dict[str, Any], user_ids: Optional[List[str]],
+                      query: Optional[Dict[str, Any]], context: Dict[str, Any]) -> int:
+        """Stream recipients and write their notifications chunk by chunk"""
+        sent = 0
+        position = 0
+        chunk: List[Dict[str, Any]] = []
+        async for recipient in self._recipients(db, user_ids, query):
+            chunk.append(recipient)
+            if len(chunk) >= DISPATCH_CHUNK_SIZE:
+                sent += await self._deliver_chunk(db, template, chunk, context, position)
+                position += len(chunk)
+                chunk = []
+        if chunk:
+            sent += await self._deliver_chunk(db, template, chunk, context, position)
+        return sent
+    
+    async def _deliver_chunk(self, db, template: Dict[str, Any], recipients: List[Dict[str, Any]],
+                             context: Dict[str, Any], position: int) -> int:
+        """Write one chunk; a failure is logged and the job moves on to the next chunk"""
+        try:
+            return await self._write_chunk(db, template, recipients, context)
+        except Exception as e:
+            logger.error(
+                f"Notification chunk failed for '{template.get('title')}' "
+                f"(recipients {position}-{position + len(recipients) - 1}): {e}"
+            )
+            return 0
+    
+    async def _recipients(self, db, user_ids: Optional[List[str]], query: Optional[Dict[str, Any]]):
+        if user_ids is not None:
+            for user_id in user_ids:
+                yield {"user_id": user_id}
+            return
+        user_field = query.get("user_field", "user_id")
+        projection = {"_id": 0, user_field: 1, **{f: 1 for f in query.get("fields", [])}}
+        cursor = db[query["collection"]].find(query.get("filter", {}), projection).batch_size(DISPATCH_CHUNK_SIZE)
+        async for doc in cursor:
+            doc["user_id"] = doc.pop(user_field)
+            yield doc
+    
+    async def _write_chunk(self, db, template: Dict[str, Any], recipients: List[Dict[str, Any]],
+                           context: Dict[str, Any]) -> int:
+        preferences = await load_preferences(db, [r["user_id"] for r in recipients])
+        now = datetime.now(timezone.utc)
+        
+        notifications = []
+        for recipient in recipients:
+            prefs = preferences[recipient["user_id"]]
+            if not category_enabled(prefs, template.get("category")):
+                continue
+            try:
+                text = render(template, {**context, **recipient})
+            except Exception as e:
+                logger.error(f"Skipped notification for {recipient['user_id']}, template failed: {e}")
+                continue
+            notifications.append({
+                "id": str(uuid.uuid4()),
+                "user_id": recipient["user_id"],
+                "notification_type": template["notification_type"],
+                **text,
+                "icon": template.get("icon", "🔔"),
+                "action_type": template.get("action_type"),
+                "action_data": template.get("action_data"),
+                "is_read": False,
+                # Still delivered to the inbox, just not pushed live
+                "silent": is_silent(prefs, now.hour),
+                "created_at": now.isoformat()
+            })
+        if not notifications:
+            return 0
+        
+        try:
+            await db.notifications.insert_many(notifications, ordered=False)
+            await db.notification_counters.bulk_write([
+                UpdateOne({"user_id": n["user_id"]}, {"$inc": {"unread": 1}}, upsert=True)
+                for n in notifications
+            ], ordered=False)
+        except Exception:
+            # Some of the chunk may be stored but not counted - recount its players
+            await recount_unread(db, [n["user_id"] for n in notifications])
+            raise
+        
+        # Stored notifications reach a reconnecting stream anyway, so a failed
+        # push is only logged
+        failed_pushes = 0
+        for notification in notifications:
+            if notification["silent"]:
+                continue
+            try:
+                await publish_to_user(notification["user_id"], "notification", notification)
+            except Exception:
+                failed_pushes += 1
+        if failed_pushes:
+            logger.warning(f"Live push failed for {failed_pushes} notifications of '{template.get('title')}'")
+        return len(notifications)
+
+
+dispatcher = NotificationDispatcher()
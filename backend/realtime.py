@@ -0,0 +1,127 @@
+# ========== GO FISH! REAL-TIME PUSH HELPERS ==========
+# Server-sent event plumbing shared by the live push endpoints
+
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Set
+import asyncio
+import json
+
+HEARTBEAT_SECONDS = 15.0
+SUBSCRIBER_QUEUE_SIZE = 16
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    """Encode one server-sent event frame"""
+    frame = ""
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    frame += f"event: {event}\n"
+    frame += f"data: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+    return frame
+
+
+class Subscriber:
+    """One connected client with a bounded outbox"""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def offer(self, frame: str) -> bool:
+        """Queue a frame without waiting; a full outbox drops the subscriber"""
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            return False
+
+
+async def sse_stream(subscriber: Subscriber, on_close: Callable[[], None],
+                     heartbeat: float = HEARTBEAT_SECONDS):
+    """Yield queued frames to the client until it disconnects or falls behind"""
+    try:
+        while not subscriber.dropped:
+            try:
+                frame = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield frame
+        # Slow consumer - tell the client to reconnect and resync
+        yield format_sse("dropped", {"reason": "too_slow"})
+    finally:
+        on_close()
+
+
+# ========== CROSS-WORKER FAN-OUT ==========
+
+class PubSub(ABC):
+    """Broadcast transport between workers; back it with Redis, NATS etc. to scale out"""
+
+    @abstractmethod
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        """Deliver a payload to every handler subscribed to the channel"""
+
+    @abstractmethod
+    def subscribe(self, channel: str, handler: Callable[[Dict[str, Any]], None]) -> Callable[[], None]:
+        """Register a handler for a channel and return the matching unsubscribe call"""
+
+
+class InProcessPubSub(PubSub):
+    """Default transport - only reaches subscribers in this worker"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Set[Callable[[Dict[str, Any]], None]]] = {}
+
+    async def publish(self, channel: str, payload: Dict[str, Any]):
+        for handler in list(self.handlers.get(channel, ())):
+            handler(payload)
+
+    def subscribe(self, channel: str, handler: Callable[[Dict[str, Any]], None]) -> Callable[[], None]:
+        self.handlers.setdefault(channel, set()).add(handler)
+
+        def unsubscribe():
+            handlers = self.handlers.get(channel)
+            if handlers is not None:
+                handlers.discard(handler)
+                if not handlers:
+                    del self.handlers[channel]
+        return unsubscribe
+
+
+_pubsub: PubSub = InProcessPubSub()
+
+
+def get_pubsub() -> PubSub:
+    return _pubsub
+
+
+def set_pubsub(pubsub: PubSub):
+    """Swap the transport, e.g. at startup when running several workers"""
+    global _pubsub
+    _pubsub = pubsub
+
+
+# ========== PER-PLAYER EVENTS ==========
+
+def user_channel(user_id: str) -> str:
+    return f"user_{user_id}"
+
+
+def event_id(doc: Dict[str, Any]) -> str:
+    """Resumable SSE id: creation time then document id"""
+    return f"{doc['created_at']}|{doc['id']}"
+
+
+async def publish_to_user(user_id: str, event: str, doc: Dict[str, Any]):
+    """Push a newly created document to the player's live stream, wherever it is connected"""
+    data = {k: v for k, v in doc.items() if k != "_id"}
+    await get_pubsub().publish(user_channel(user_id), {"event": event, "data": data})
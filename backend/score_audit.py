@@ -0,0 +1,210 @@
+# ========== GO FISH! SCORE AUDIT (ANTI-CHEAT) ==========
+# Vectorized plausibility checks for tournament entries and score submissions
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+import numpy as np
+
+
+# ========== AUDIT LIMITS ==========
+
+AUDIT_CHUNK_SIZE = 10000
+TIMELINE_LIMIT = 200  # most recent score updates kept per entry
+
+# Largest size any fish can reach on each stage (fishData.js habitats)
+STAGE_MAX_FISH_SIZE = np.array([350, 450, 1200, 2000])
+
+# Best fish (50,000 points) with the maximum combo and streak bonus
+MAX_POINTS_PER_CATCH = 200000
+MAX_POINTS_PER_MINUTE = 60000
+MAX_CATCHES_PER_MINUTE = 12
+MIN_SESSION_MINUTES = 5.0
+
+
+def _timestamp(value: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value).timestamp()
+
+
+def flag_entries(entries: List[Dict[str, Any]], timelines: Dict[str, Dict[str, Any]]) -> List[List[str]]:
+    """Return the audit flags raised by each entry of one chunk"""
+    n = len(entries)
+    score = np.fromiter((e.get("score", 0) for e in entries), dtype=np.float64, count=n)
+    fish = np.fromiter((e.get("fish_caught", 0) for e in entries), dtype=np.float64, count=n)
+    biggest = np.fromiter((e.get("biggest_fish", 0) for e in entries), dtype=np.float64, count=n)
+    combo = np.fromiter((e.get("combo_max", 0) for e in entries), dtype=np.float64, count=n)
+    perfect = np.fromiter((e.get("perfect_catches", 0) for e in entries), dtype=np.float64, count=n)
+    stage = np.fromiter((e.get("max_stage", -1) for e in entries), dtype=np.int64, count=n)
+    joined = np.fromiter((_timestamp(e.get("joined_at")) for e in entries), dtype=np.float64, count=n)
+    updated = np.fromiter((_timestamp(e.get("last_updated")) for e in entries), dtype=np.float64, count=n)
+
+    minutes = np.maximum((updated - joined) / 60.0, MIN_SESSION_MINUTES)
+
+    # Entries that never reported a stage are held to the largest stage limit
+    stage = np.where((stage < 0) | (stage >= len(STAGE_MAX_FISH_SIZE)), len(STAGE_MAX_FISH_SIZE) - 1, stage)
+
+    checks = {
+        "points_per_minute": score / minutes > MAX_POINTS_PER_MINUTE,
+        "points_per_catch": score > np.maximum(fish, 1) * MAX_POINTS_PER_CATCH,
+        "fish_size": biggest > STAGE_MAX_FISH_SIZE[stage],
+        "combo_ratio": (combo > fish) | (perfect > fish),
+        "negative_score": score < 0,
+    }
+    checks.update(_flag_timelines(entries, timelines))
+
+    flags: List[List[str]] = [[] for _ in range(n)]
+    for name, mask in checks.items():
+        for i in np.flatnonzero(mask):
+            flags[i].append(name)
+    return flags
+
+
+def _flag_timelines(entries: List[Dict[str, Any]], timelines: Dict[str, Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Burst checks over the per-update timelines, flattened into one array per field"""
+    n = len(entries)
+    lengths = np.zeros(n, dtype=np.int64)
+    times, deltas, catches = [], [], []
+    for i, entry in enumerate(entries):
+        timeline = timelines.get(entry["id"])
+        if not timeline:
+            continue
+        lengths[i] = len(timeline["t"])
+        times.extend(timeline["t"])
+        deltas.extend(timeline["delta"])
+        catches.extend(timeline["fish"])
+
+    burst_catch = np.zeros(n, dtype=bool)
+    burst_points = np.zeros(n, dtype=bool)
+    if not times:
+        return {"catch_rate": burst_catch, "update_points": burst_points}
+
+    t = np.asarray(times, dtype=np.float64)
+    delta = np.asarray(deltas, dtype=np.float64)
+    caught = np.asarray(catches, dtype=np.float64)
+    owner = np.repeat(np.arange(n), lengths)
+
+    # Catch rate between consecutive updates of the same entry
+    same = owner[1:] == owner[:-1]
+    gap_minutes = np.maximum(np.diff(t) / 60.0, 1.0 / 60.0)
+    too_fast = same & (caught[1:] / gap_minutes > MAX_CATCHES_PER_MINUTE) & (caught[1:] > 1)
+    np.logical_or.at(burst_catch, owner[1:][too_fast], True)
+
+    # A single update cannot be worth more than its catches allow
+    too_rich = delta > np.maximum(caught, 1) * MAX_POINTS_PER_CATCH
+    np.logical_or.at(burst_points, owner[too_rich], True)
+
+    return {"catch_rate": burst_catch, "update_points": burst_points}
+
+
+async def audit_tournament(db, tournament_id: str) -> Dict[str, int]:
+    """Stream a tournament's entries in chunks and quarantine implausible ones"""
+    cursor = db.tournament_entries.find(
+        {"tournament_id": tournament_id, "audit_cleared": {"$ne": True}},
+        {"_id": 0, "id": 1, "score": 1, "fish_caught": 1, "biggest_fish": 1, "combo_max": 1,
+         "perfect_catches": 1, "max_stage": 1, "joined_at": 1, "last_updated": 1}
+    ).batch_size(AUDIT_CHUNK_SIZE)
+
+    audited = 0
+    quarantined = 0
+    chunk: List[Dict[str, Any]] = []
+    async for entry in cursor:
+        chunk.append(entry)
+        if len(chunk) >= AUDIT_CHUNK_SIZE:
+            quarantined += await _audit_entry_chunk(db, chunk)
+            audited += len(chunk)
+            chunk = []
+    if chunk:
+        quarantined += await _audit_entry_chunk(db, chunk)
+        audited += len(chunk)
+
+    return {"audited": audited, "quarantined": quarantined}
+
+
+async def _audit_entry_chunk(db, chunk: List[Dict[str, Any]]) -> int:
+    ids = [e["id"] for e in chunk]
+    timelines = {
+        t["entry_id"]: t
+        async for t in db.tournament_score_timeline.find(
+            {"entry_id": {"$in": ids}},
+            {"_id": 0, "entry_id": 1, "t": 1, "delta": 1, "fish": 1}
+        )
+    }
+    flags = flag_entries(chunk, timelines)
+    now = datetime.now(timezone.utc).isoformat()
+    updates = [
+        UpdateOne(
+            {"id": entry["id"]},
+            {"$set": {"quarantined": True, "audit_flags": entry_flags, "audited_at": now}}
+        )
+        for entry, entry_flags in zip(chunk, flags) if entry_flags
+    ]
+    if updates:
+        await db.tournament_entries.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+# ========== SCORE SUBMISSIONS ==========
+
+def flag_scores(scores: List[Dict[str, Any]]) -> List[List[str]]:
+    """Return the audit flags raised by each submitted score of one chunk"""
+    n = len(scores)
+    score = np.fromiter((s.get("score", 0) for s in scores), dtype=np.float64, count=n)
+    catches = np.fromiter((s.get("catches", 0) for s in scores), dtype=np.float64, count=n)
+    stage = np.fromiter((s.get("stage", 0) for s in scores), dtype=np.int64, count=n)
+
+    checks = {
+        "points_per_catch": score > np.maximum(catches, 1) * MAX_POINTS_PER_CATCH,
+        "stage": (stage < 0) | (stage >= len(STAGE_MAX_FISH_SIZE)),
+        "negative_score": score < 0,
+    }
+
+    flags: List[List[str]] = [[] for _ in range(n)]
+    for name, mask in checks.items():
+        for i in np.flatnonzero(mask):
+            flags[i].append(name)
+    return flags
+
+
+async def audit_scores(db, since: Optional[str] = None) -> Dict[str, int]:
+    """Stream submitted scores in chunks and quarantine implausible ones"""
+    query: Dict[str, Any] = {"audited": {"$ne": True}}
+    if since:
+        query["timestamp"] = {"$gte": since}
+    cursor = db.scores.find(
+        query,
+        {"_id": 0, "id": 1, "score": 1, "catches": 1, "stage": 1}
+    ).batch_size(AUDIT_CHUNK_SIZE)
+
+    audited = 0
+    quarantined = 0
+    chunk: List[Dict[str, Any]] = []
+    async for score in cursor:
+        chunk.append(score)
+        if len(chunk) >= AUDIT_CHUNK_SIZE:
+            quarantined += await _audit_score_chunk(db, chunk)
+            audited += len(chunk)
+            chunk = []
+    if chunk:
+        quarantined += await _audit_score_chunk(db, chunk)
+        audited += len(chunk)
+
+    return {"audited": audited, "quarantined": quarantined}
+
+
+async def _audit_score_chunk(db, chunk: List[Dict[str, Any]]) -> int:
+    flags = flag_scores(chunk)
+    clean_ids = [score["id"] for score, score_flags in zip(chunk, flags) if not score_flags]
+    updates = [
+        UpdateOne(
+            {"id": score["id"]},
+            {"$set": {"audited": True, "quarantined": True, "audit_flags": score_flags}}
+        )
+        for score, score_flags in zip(chunk, flags) if score_flags
+    ]
+    if clean_ids:
+        await db.scores.update_many({"id": {"$in": clean_ids}}, {"$set": {"audited": True}})
+    if updates:
+        await db.scores.bulk_write(updates, ordered=False)
+    return len(updates)
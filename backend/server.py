@@ -12,6 +12,9 @@ from datetime import datetime, timezone, timedelta
 import aiohttp
 from bson import ObjectId
 
+from score_audit import audit_scores
+from text_search import SEARCH_FIELD, search_terms
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -110,18 +113,18 @@ class Weather(BaseModel):
 @api_router.post("/user", response_model=dict)
 async def create_or_get_user(input: UserCreate):
     """Create new user or return existing user by device_id"""
-    existing = await db.users.find_one({"device_id": input.device_id}, {"_id": 0})
+    existing = await db.users.find_one({"device_id": input.device_id}, {"_id": 0, SEARCH_FIELD: 0})
     if existing:
         return existing
     
     user = User(device_id=input.device_id, username=input.username)
-    await db.users.insert_one(user.model_dump())
+    await db.users.insert_one({**user.model_dump(), SEARCH_FIELD: search_terms(user.username)})
     return user.model_dump()
 
 @api_router.get("/user/{device_id}", response_model=dict)
 async def get_user(device_id: str):
     """Get user by device_id"""
-    user = await db.users.find_one({"device_id": device_id}, {"_id": 0})
+    user = await db.users.find_one({"device_id": device_id}, {"_id": 0, SEARCH_FIELD: 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -231,7 +234,10 @@ async def create_score(input: ScoreCreate):
 @api_router.get("/leaderboard", response_model=List[dict])
 async def get_leaderboard(limit: int = 100):
     """Get top scores (global leaderboard)"""
-    scores = await db.scores.find({}, {"_id": 0}).sort("score", -1).limit(limit).to_list(limit)
+    scores = await db.scores.find(
+        {"quarantined": {"$ne": True}},
+        {"_id": 0}
+    ).sort("score", -1).limit(limit).to_list(limit)
     return [
         {
             "username": s["username"],
@@ -244,6 +250,13 @@ async def get_leaderboard(limit: int = 100):
     ]
 
 
+@api_router.post("/admin/audit-scores")
+async def admin_audit_scores(since: Optional[str] = None):
+    """Run the anti-cheat audit over submitted scores not yet audited"""
+    result = await audit_scores(db, since)
+    return {"success": True, **result}
+
+
 # ========== WEATHER ROUTES ==========
 @api_router.get("/weather")
 async def get_weather():
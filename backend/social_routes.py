@@ -1,15 +1,26 @@
 # ========== GO FISH! SOCIAL & GIFT SYSTEM API ==========
 # Friend system, gifts, and social interactions
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, Field
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
 import uuid
 import os
+import logging
+import time
+
+from notification_dispatcher import PREFERENCE_DEFAULTS, category_enabled, is_silent, load_preferences
+from realtime import SSE_HEADERS, Subscriber, event_id, format_sse, get_pubsub, publish_to_user, sse_stream, user_channel
+from text_search import SEARCH_FIELD, backfill_search_terms, prefix_filter, rank_matches
 
 router = APIRouter(prefix="/api/social", tags=["social"])
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL')
@@ -17,6 +28,28 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME')]
 
 
+@router.on_event("startup")
+async def ensure_social_indexes():
+    """Create indexes the social endpoints rely on"""
+    await db.users.create_index(SEARCH_FIELD)
+    asyncio.create_task(backfill_search_terms(db.users, ["username"]))
+    await db.activity_feed.create_index("id")
+    await db.activity_feed.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+    await db.feed_timelines.create_index("user_id", unique=True)
+    await db.users.create_index(
+        [("feed_fanout_read", 1), ("id", 1)],
+        partialFilterExpression={"feed_fanout_read": True}
+    )
+    await db.activity_likes.create_index([("activity_id", 1), ("user_id", 1)], unique=True)
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index("read_at", expireAfterSeconds=READ_NOTIFICATION_TTL_DAYS * 86400)
+    await db.notification_counters.create_index("user_id", unique=True)
+    await db.notification_preferences.create_index("user_id", unique=True)
+    await db.gifts.create_index([("to_user_id", 1), ("created_at", 1)])
+    await db.friend_requests.create_index([("to_user_id", 1), ("created_at", 1)])
+    asyncio.create_task(_run_social_migrations())
+
+
 # ========== GIFT CONFIGURATIONS ==========
 
 GIFT_TYPES = {
@@ -61,6 +94,182 @@ class ClaimGiftRequest(BaseModel):
     user_id: str
 
 
+class NotificationPreferencesRequest(BaseModel):
+    """Only the fields sent are changed; send null to clear quiet hours"""
+    push_enabled: Optional[bool] = None
+    email_enabled: Optional[bool] = None
+    tournament_alerts: Optional[bool] = None
+    guild_alerts: Optional[bool] = None
+    gift_alerts: Optional[bool] = None
+    daily_reminder: Optional[bool] = None
+    energy_full_alert: Optional[bool] = None
+    quiet_hours_start: Optional[int] = Field(None, ge=0, le=23)  # UTC hour
+    quiet_hours_end: Optional[int] = Field(None, ge=0, le=23)
+
+
+class LikedCheckRequest(BaseModel):
+    user_id: str
+    activity_ids: List[str]
+
+
+# ========== FRIENDSHIP KEYS ==========
+
+# Each pair of players has one canonical key (sorted ids), unique across
+# friendships and across pending requests, so existence checks are point
+# lookups and concurrent requests/accepts cannot create duplicates.
+
+def _pair_key(user_a: str, user_b: str) -> str:
+    return ":".join(sorted((user_a, user_b)))
+
+
+def _pair_key_expr(field_a: str, field_b: str) -> Dict[str, Any]:
+    """Aggregation expression computing the pair key of two id fields"""
+    return {"$cond": [
+        {"$lt": [f"${field_a}", f"${field_b}"]},
+        {"$concat": [f"${field_a}", ":", f"${field_b}"]},
+        {"$concat": [f"${field_b}", ":", f"${field_a}"]}
+    ]}
+
+
+async def migrate_friendships() -> Dict[str, int]:
+    """Add pair keys to existing friendships and requests, fold duplicates, then index them"""
+    # Key every document in one server-side pass per collection
+    keyed = await db.friendships.update_many(
+        {"pair_key": {"$exists": False}},
+        [{"$set": {
+            "pair_key": _pair_key_expr("user_id_1", "user_id_2"),
+            "members": ["$user_id_1", "$user_id_2"]
+        }}]
+    )
+    await db.friend_requests.update_many(
+        {"pair_key": {"$exists": False}},
+        [{"$set": {"pair_key": _pair_key_expr("from_user_id", "to_user_id")}}]
+    )
+    
+    # Keep the oldest friendship of each pair and fold the others' gift counts into it
+    duplicates = await db.friendships.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$pair_key",
+            "ids": {"$push": "$id"},
+            "gifts_sent": {"$push": {"$ifNull": ["$gifts_sent", 0]}},
+            "gifts_received": {"$push": {"$ifNull": ["$gifts_received", 0]}}
+        }},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ], allowDiskUse=True).to_list(None)
+    merges, extra_ids = [], []
+    for dup in duplicates:
+        merges.append(UpdateOne({"id": dup["ids"][0]}, {"$inc": {
+            "gifts_sent": sum(dup["gifts_sent"][1:]),
+            "gifts_received": sum(dup["gifts_received"][1:])
+        }}))
+        extra_ids.extend(dup["ids"][1:])
+    if merges:
+        await db.friendships.bulk_write(merges, ordered=False)
+        await db.friendships.delete_many({"id": {"$in": extra_ids}})
+    
+    # Only the oldest pending request of a pair stays pending
+    pending_dups = await db.friend_requests.aggregate([
+        {"$match": {"status": "pending"}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": "$pair_key", "ids": {"$push": "$id"}}},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ], allowDiskUse=True).to_list(None)
+    superseded = [request_id for dup in pending_dups for request_id in dup["ids"][1:]]
+    if superseded:
+        await db.friend_requests.update_many(
+            {"id": {"$in": superseded}},
+            {"$set": {"status": "superseded"}}
+        )
+    
+    await db.friendships.create_index("pair_key", unique=True)
+    await db.friendships.create_index("members")
+    await db.friend_requests.create_index(
+        "pair_key", unique=True, name="pending_pair_key",
+        partialFilterExpression={"status": "pending"}
+    )
+    _friend_graph.clear()
+    
+    return {
+        "friendships_keyed": keyed.modified_count,
+        "duplicate_friendships_removed": len(extra_ids),
+        "duplicate_requests_superseded": len(superseded)
+    }
+
+
+async def _run_social_migrations():
+    try:
+        await migrate_friendships()
+    except Exception as e:
+        logger.error(f"Friendship migration failed: {e}")
+    try:
+        await migrate_likes()
+    except Exception as e:
+        logger.error(f"Likes migration failed: {e}")
+    try:
+        if await db.notification_counters.estimated_document_count() == 0:
+            await rebuild_notification_counters()
+    except Exception as e:
+        logger.error(f"Notification counter rebuild failed: {e}")
+
+
+@router.post("/admin/migrate-friendships")
+async def admin_migrate_friendships():
+    """Admin endpoint to (re-)run the friendship pair-key migration"""
+    result = await migrate_friendships()
+    return {"success": True, **result}
+
+
+# ========== FRIEND GRAPH CACHE ==========
+
+# Per-user adjacency (friend id -> friendship metadata) shared by the friend
+# list, profile, feed and gift checks. Changes made through this worker drop
+# the affected users at once; the TTL bounds staleness from other workers.
+
+FRIEND_GRAPH_TTL_SECONDS = 60.0
+FRIEND_GRAPH_MAX_USERS = 10000
+FRIENDSHIP_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "user_id_1": 1,
+    "user_id_2": 1,
+    "friendship_level": 1,
+    "gifts_sent": 1,
+    "gifts_received": 1,
+}
+
+_friend_graph: Dict[str, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+
+
+async def _friends_of(user_id: str) -> Dict[str, Dict[str, Any]]:
+    """Friend id -> friendship for one user, served from the cache when fresh"""
+    cached = _friend_graph.get(user_id)
+    if cached and time.monotonic() - cached[0] < FRIEND_GRAPH_TTL_SECONDS:
+        return cached[1]
+    
+    friendships = await db.friendships.find({"members": user_id}, FRIENDSHIP_PROJECTION).to_list(None)
+    adjacency = {
+        (fs["user_id_2"] if fs["user_id_1"] == user_id else fs["user_id_1"]): fs
+        for fs in friendships
+    }
+    
+    _friend_graph.pop(user_id, None)
+    if len(_friend_graph) >= FRIEND_GRAPH_MAX_USERS:
+        # Oldest entry first - dicts keep insertion order
+        del _friend_graph[next(iter(_friend_graph))]
+    _friend_graph[user_id] = (time.monotonic(), adjacency)
+    return adjacency
+
+
+async def _friendship(user_id: str, other_id: str) -> Optional[Dict[str, Any]]:
+    return (await _friends_of(user_id)).get(other_id)
+
+
+def _invalidate_friends(*user_ids: str):
+    for user_id in user_ids:
+        _friend_graph.pop(user_id, None)
+
+
 # ========== FRIEND SYSTEM ==========
 
 @router.post("/friends/request")
@@ -70,27 +279,13 @@ async def send_friend_request(request: FriendRequestModel):
         raise HTTPException(status_code=400, detail="Cannot friend yourself")
     
     # Check if already friends
-    existing_friendship = await db.friendships.find_one({
-        "$or": [
-            {"user_id_1": request.from_user_id, "user_id_2": request.to_user_id},
-            {"user_id_1": request.to_user_id, "user_id_2": request.from_user_id}
-        ]
-    })
+    existing_friendship = await _friendship(request.from_user_id, request.to_user_id)
     if existing_friendship:
         raise HTTPException(status_code=400, detail="Already friends")
     
-    # Check for pending request
-    existing_request = await db.friend_requests.find_one({
-        "$or": [
-            {"from_user_id": request.from_user_id, "to_user_id": request.to_user_id, "status": "pending"},
-            {"from_user_id": request.to_user_id, "to_user_id": request.from_user_id, "status": "pending"}
-        ]
-    })
-    if existing_request:
-        raise HTTPException(status_code=400, detail="Friend request already exists")
-    
     friend_request = {
         "id": str(uuid.uuid4()),
+        "pair_key": _pair_key(request.from_user_id, request.to_user_id),
         "from_user_id": request.from_user_id,
         "from_username": request.from_username,
         "to_user_id": request.to_user_id,
@@ -99,7 +294,12 @@ async def send_friend_request(request: FriendRequestModel):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.friend_requests.insert_one(friend_request)
+    # The pending pair-key index rejects a second request in either direction
+    try:
+        await db.friend_requests.insert_one(friend_request)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Friend request already exists")
+    await publish_to_user(request.to_user_id, "friend_request", friend_request)
     
     # Create notification for recipient
     notification = {
@@ -114,7 +314,7 @@ async def send_friend_request(request: FriendRequestModel):
         "is_read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.notifications.insert_one(notification)
+    await _create_notification(notification)
     
     return {"success": True, "request": {k: v for k, v in friend_request.items() if k != "_id"}}
 
@@ -138,11 +338,12 @@ async def get_friend_requests(user_id: str):
 @router.post("/friends/accept")
 async def accept_friend_request(request: AcceptFriendRequest):
     """Accept a friend request"""
-    friend_request = await db.friend_requests.find_one({
-        "id": request.request_id,
-        "to_user_id": request.user_id,
-        "status": "pending"
-    })
+    # Claim the request first, so a double accept creates one friendship
+    friend_request = await db.friend_requests.find_one_and_update(
+        {"id": request.request_id, "to_user_id": request.user_id, "status": "pending"},
+        {"$set": {"status": "accepted"}},
+        projection={"_id": 0}
+    )
     
     if not friend_request:
         raise HTTPException(status_code=404, detail="Friend request not found")
@@ -150,6 +351,8 @@ async def accept_friend_request(request: AcceptFriendRequest):
     # Create friendship
     friendship = {
         "id": str(uuid.uuid4()),
+        "pair_key": _pair_key(friend_request["from_user_id"], friend_request["to_user_id"]),
+        "members": [friend_request["from_user_id"], friend_request["to_user_id"]],
         "user_id_1": friend_request["from_user_id"],
         "user_id_2": friend_request["to_user_id"],
         "friendship_level": 1,
@@ -159,13 +362,12 @@ async def accept_friend_request(request: AcceptFriendRequest):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.friendships.insert_one(friendship)
-    
-    # Update request status
-    await db.friend_requests.update_one(
-        {"id": request.request_id},
-        {"$set": {"status": "accepted"}}
-    )
+    try:
+        await db.friendships.insert_one(friendship)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Already friends")
+    finally:
+        _invalidate_friends(friendship["user_id_1"], friendship["user_id_2"])
     
     # Notify sender
     to_user = await db.users.find_one({"id": request.user_id}, {"_id": 0, "username": 1})
@@ -179,7 +381,7 @@ async def accept_friend_request(request: AcceptFriendRequest):
         "is_read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.notifications.insert_one(notification)
+    await _create_notification(notification)
     
     return {"success": True, "friendship": {k: v for k, v in friendship.items() if k != "_id"}}
 
@@ -197,17 +399,22 @@ async def reject_friend_request(request: AcceptFriendRequest):
 @router.get("/friends/{user_id}")
 async def get_friends(user_id: str):
     """Get user's friends list"""
-    friendships = await db.friendships.find({
-        "$or": [
-            {"user_id_1": user_id},
-            {"user_id_2": user_id}
-        ]
-    }, {"_id": 0}).to_list(100)
+    adjacency = await _friends_of(user_id)
+    if not adjacency:
+        return {"friends": [], "count": 0}
+    
+    # One round trip for every friend's profile
+    profiles = {
+        u["id"]: u
+        async for u in db.users.find(
+            {"id": {"$in": list(adjacency)}},
+            {"_id": 0, "id": 1, "username": 1, "level": 1, "high_score": 1}
+        )
+    }
     
     friends = []
-    for fs in friendships:
-        friend_id = fs["user_id_2"] if fs["user_id_1"] == user_id else fs["user_id_1"]
-        friend_user = await db.users.find_one({"id": friend_id}, {"_id": 0, "id": 1, "username": 1, "level": 1, "high_score": 1})
+    for friend_id, fs in adjacency.items():
+        friend_user = profiles.get(friend_id)
         if friend_user:
             friend_user["friendship_level"] = fs["friendship_level"]
             friend_user["friendship_id"] = fs["id"]
@@ -220,13 +427,9 @@ async def get_friends(user_id: str):
 @router.delete("/friends/{user_id}/{friend_id}")
 async def remove_friend(user_id: str, friend_id: str):
     """Remove a friend"""
-    result = await db.friendships.delete_one({
-        "$or": [
-            {"user_id_1": user_id, "user_id_2": friend_id},
-            {"user_id_1": friend_id, "user_id_2": user_id}
-        ]
-    })
+    result = await db.friendships.delete_one({"pair_key": _pair_key(user_id, friend_id)})
     
+    _invalidate_friends(user_id, friend_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Friendship not found")
     
@@ -250,12 +453,7 @@ async def send_gift(request: SendGiftRequest):
     gift_config = GIFT_TYPES[request.gift_type]
     
     # Check if friends
-    friendship = await db.friendships.find_one({
-        "$or": [
-            {"user_id_1": request.from_user_id, "user_id_2": request.to_user_id},
-            {"user_id_1": request.to_user_id, "user_id_2": request.from_user_id}
-        ]
-    })
+    friendship = await _friendship(request.from_user_id, request.to_user_id)
     
     if not friendship:
         raise HTTPException(status_code=400, detail="Must be friends to send gifts")
@@ -297,12 +495,14 @@ async def send_gift(request: SendGiftRequest):
     }
     
     await db.gifts.insert_one(gift)
+    await publish_to_user(request.to_user_id, "gift", gift)
     
     # Update friendship stats
     await db.friendships.update_one(
         {"id": friendship["id"]},
         {"$inc": {"gifts_sent": 1}}
     )
+    _invalidate_friends(request.from_user_id, request.to_user_id)
     
     # Notify recipient
     notification = {
@@ -317,7 +517,7 @@ async def send_gift(request: SendGiftRequest):
         "is_read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.notifications.insert_one(notification)
+    await _create_notification(notification, category="gift")
     
     return {"success": True, "gift": {k: v for k, v in gift.items() if k != "_id"}}
 
@@ -444,13 +644,16 @@ async def claim_all_gifts(user_id: str):
 @router.get("/search/players")
 async def search_players(query: str, limit: int = 20):
     """Search for players by username"""
-    if len(query) < 2:
+    if len(query.strip()) < 2:
         raise HTTPException(status_code=400, detail="Query too short")
     
-    players = await db.users.find(
-        {"username": {"$regex": query, "$options": "i"}},
+    limit = max(1, min(limit, 50))
+    # Over-fetch a little so exact and whole-name matches can be ranked first
+    candidates = await db.users.find(
+        prefix_filter(query),
         {"_id": 0, "id": 1, "username": 1, "level": 1, "high_score": 1, "total_catches": 1}
-    ).limit(limit).to_list(limit)
+    ).limit(limit * 3).to_list(limit * 3)
+    players = rank_matches(candidates, query, ["username"], lambda p: -p.get("level", 1))[:limit]
     
     return {"players": players}
 
@@ -485,12 +688,7 @@ async def get_player_profile(user_id: str, viewer_id: str = None):
     is_friend = False
     friendship_id = None
     if viewer_id and viewer_id != user_id:
-        friendship = await db.friendships.find_one({
-            "$or": [
-                {"user_id_1": viewer_id, "user_id_2": user_id},
-                {"user_id_1": user_id, "user_id_2": viewer_id}
-            ]
-        })
+        friendship = await _friendship(viewer_id, user_id)
         if friendship:
             is_friend = True
             friendship_id = friendship["id"]
@@ -515,32 +713,159 @@ async def get_player_profile(user_id: str, viewer_id: str = None):
 
 # ========== ACTIVITY FEED ==========
 
-@router.get("/feed/{user_id}")
-async def get_activity_feed(user_id: str, limit: int = 20):
-    """Get activity feed from friends"""
-    # Get friends list
-    friendships = await db.friendships.find({
-        "$or": [
-            {"user_id_1": user_id},
-            {"user_id_2": user_id}
+# Posts are pushed into each friend's capped timeline document (fan-out on
+# write). Authors with FANOUT_READ_THRESHOLD or more friends are flagged and
+# skipped instead; readers pull their posts at read time and merge them in.
+# Pages are keyed on (created_at, id), so posts sharing a timestamp at a page
+# boundary are neither skipped nor repeated.
+
+TIMELINE_SIZE = 500
+ACTIVITY_PROJECTION = {"_id": 0, "liked_by": 0}  # legacy likes array on unmigrated posts
+FANOUT_READ_THRESHOLD = 500
+FEED_PAGE_MAX = 50
+
+
+async def _read_side_friends(friend_ids: List[str]) -> List[str]:
+    """Which of these friends are flagged for read-time pulls, straight from the users collection"""
+    return [
+        u["id"] async for u in db.users.find(
+            {"id": {"$in": friend_ids}, "feed_fanout_read": True},
+            {"_id": 0, "id": 1}
+        )
+    ]
+
+
+def _feed_cursor(before: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(created_at, id) position from a next_cursor; a bare timestamp pages strictly before it"""
+    if not before:
+        return None
+    created_at, _, activity_id = before.partition("|")
+    return created_at, activity_id
+
+
+async def _pull_posts(author_ids: List[str], before: Optional[Tuple[str, str]], limit: int) -> List[Dict[str, Any]]:
+    """Newest posts of these authors strictly before a (created_at, id) position"""
+    query: Dict[str, Any] = {"user_id": {"$in": author_ids}}
+    if before:
+        query["$or"] = [
+            {"created_at": {"$lt": before[0]}},
+            {"created_at": before[0], "id": {"$lt": before[1]}}
         ]
-    }, {"_id": 0}).to_list(100)
+    return await db.activity_feed.find(query, ACTIVITY_PROJECTION).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+
+
+async def _fan_out(activity: Dict[str, Any]) -> bool:
+    """Push a new post onto every friend's timeline; False if the author is read-side"""
+    author_id = activity["user_id"]
+    friend_ids = list(await _friends_of(author_id))
+    if len(friend_ids) >= FANOUT_READ_THRESHOLD:
+        # Readers on every worker see the flag on their next feed read
+        await db.users.update_one(
+            {"id": author_id, "feed_fanout_read": {"$ne": True}},
+            {"$set": {"feed_fanout_read": True}}
+        )
+        return False
     
-    friend_ids = []
-    for fs in friendships:
-        friend_id = fs["user_id_2"] if fs["user_id_1"] == user_id else fs["user_id_1"]
-        friend_ids.append(friend_id)
+    entry = {"activity_id": activity["id"], "author_id": author_id, "created_at": activity["created_at"]}
+    updates = [
+        UpdateOne(
+            {"user_id": friend_id},
+            {"$push": {"entries": {"$each": [entry], "$sort": {"created_at": -1}, "$slice": TIMELINE_SIZE}}},
+            upsert=True
+        )
+        for friend_id in friend_ids
+    ]
+    if updates:
+        await db.feed_timelines.bulk_write(updates, ordered=False)
+    return True
+
+
+async def _load_timeline(user_id: str, friend_ids: List[str]) -> List[Dict[str, Any]]:
+    """A user's timeline entries, seeded from friends' recent posts on first use"""
+    timeline = await db.feed_timelines.find_one({"user_id": user_id}, {"_id": 0, "entries": 1, "seeded": 1})
+    if timeline and timeline.get("seeded"):
+        return timeline["entries"]
+    
+    # Pushes may already have created the document; merge the backlog into it
+    recent = await db.activity_feed.find(
+        {"user_id": {"$in": friend_ids}},
+        {"_id": 0, "id": 1, "user_id": 1, "created_at": 1}
+    ).sort("created_at", -1).limit(TIMELINE_SIZE).to_list(TIMELINE_SIZE)
+    seen = {e["activity_id"] for e in (timeline or {}).get("entries", [])}
+    backlog = [
+        {"activity_id": a["id"], "author_id": a["user_id"], "created_at": a["created_at"]}
+        for a in recent if a["id"] not in seen
+    ]
+    timeline = await db.feed_timelines.find_one_and_update(
+        {"user_id": user_id},
+        {
+            "$push": {"entries": {"$each": backlog, "$sort": {"created_at": -1}, "$slice": TIMELINE_SIZE}},
+            "$set": {"seeded": True}
+        },
+        projection={"_id": 0, "entries": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return timeline["entries"]
+
+
+@router.get("/feed/{user_id}")
+async def get_activity_feed(user_id: str, limit: int = 20, before: Optional[str] = None):
+    """Get activity feed from friends, newest first; pass next_cursor as before= for older posts"""
+    limit = max(1, min(limit, FEED_PAGE_MAX))
+    # Get friends list
+    friend_ids = list(await _friends_of(user_id))
     
     if not friend_ids:
-        return {"feed": []}
+        return {"feed": [], "next_cursor": None}
     
-    # Get recent activities from friends
-    activities = await db.activity_feed.find(
-        {"user_id": {"$in": friend_ids}},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(limit).to_list(limit)
+    cursor = _feed_cursor(before)
     
-    return {"feed": activities}
+    # Pushed entries from the precomputed timeline
+    entries = await _load_timeline(user_id, friend_ids)
+    friends = set(friend_ids)
+    pushed = sorted(
+        (
+            e for e in entries
+            if e["author_id"] in friends and (not cursor or (e["created_at"], e["activity_id"]) < cursor)
+        ),
+        key=lambda e: (e["created_at"], e["activity_id"]),
+        reverse=True
+    )[:limit]
+    
+    # Pulled posts: high-follower friends always, and every friend's posts
+    # older than a full timeline's tail once the pushed entries run short
+    pulls = []
+    read_side = await _read_side_friends(friend_ids)
+    if len(entries) >= TIMELINE_SIZE and len(pushed) < limit:
+        tail = min((e["created_at"], e["activity_id"]) for e in entries)
+        older = min(cursor, tail) if cursor else tail
+        pulls.append(_pull_posts(friend_ids, older, limit))
+        if older == cursor:
+            read_side = []  # the direct read already covers them
+    if read_side:
+        pulls.append(_pull_posts(read_side, cursor, limit))
+    pulled = [a for posts in await asyncio.gather(*pulls) for a in posts]
+    
+    # Merge, then load the pushed posts in one query
+    merged = {e["activity_id"]: e["created_at"] for e in pushed}
+    merged.update((a["id"], a["created_at"]) for a in pulled)
+    refs = sorted(((created_at, activity_id) for activity_id, created_at in merged.items()), reverse=True)[:limit]
+    page_ids = [activity_id for _, activity_id in refs]
+    activities = {a["id"]: a for a in pulled}
+    missing = [i for i in page_ids if i not in activities]
+    if missing:
+        async for activity in db.activity_feed.find({"id": {"$in": missing}}, ACTIVITY_PROJECTION):
+            activities[activity["id"]] = activity
+    
+    feed = [activities[i] for i in page_ids if i in activities]
+    liked = await _liked_ids(user_id, page_ids)
+    for activity in feed:
+        activity["liked"] = activity["id"] in liked
+    next_cursor = f"{refs[-1][0]}|{refs[-1][1]}" if len(refs) == limit else None
+    return {"feed": feed, "next_cursor": next_cursor}
 
 
 @router.post("/activity/post")
@@ -558,39 +883,198 @@ async def post_activity(
         "activity_type": activity_type,
         "content": content,
         "likes": 0,
-        "liked_by": [],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.activity_feed.insert_one(activity)
+    await _fan_out(activity)
     return {"success": True, "activity": {k: v for k, v in activity.items() if k != "_id"}}
 
 
+# ========== ACTIVITY LIKES ==========
+
+# One document per (activity, user) under a unique index; the post keeps a
+# denormalized likes counter moved only by the write that changed a like.
+
+LIKES_MIGRATION_BATCH_SIZE = 500
+
+
+async def _liked_ids(user_id: str, activity_ids: List[str]) -> set:
+    """Which of these activities the user has liked, in one query"""
+    if not activity_ids:
+        return set()
+    return {
+        like["activity_id"]
+        async for like in db.activity_likes.find(
+            {"activity_id": {"$in": activity_ids}, "user_id": user_id},
+            {"_id": 0, "activity_id": 1}
+        )
+    }
+
+
 @router.post("/activity/{activity_id}/like")
 async def like_activity(activity_id: str, user_id: str):
-    """Like an activity"""
-    activity = await db.activity_feed.find_one({"id": activity_id}, {"_id": 0})
+    """Like an activity, or unlike it if already liked"""
+    activity = await db.activity_feed.find_one({"id": activity_id}, {"_id": 0, "id": 1})
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
-    if user_id in activity.get("liked_by", []):
-        # Unlike
-        await db.activity_feed.update_one(
-            {"id": activity_id},
-            {"$inc": {"likes": -1}, "$pull": {"liked_by": user_id}}
-        )
+    # Unlike - only the request that actually removed the like decrements
+    removed = await db.activity_likes.delete_one({"activity_id": activity_id, "user_id": user_id})
+    if removed.deleted_count:
+        await db.activity_feed.update_one({"id": activity_id}, {"$inc": {"likes": -1}})
         return {"success": True, "action": "unliked"}
-    else:
-        # Like
-        await db.activity_feed.update_one(
-            {"id": activity_id},
-            {"$inc": {"likes": 1}, "$push": {"liked_by": user_id}}
-        )
+    
+    # Like - the unique index turns a concurrent double-like into a no-op
+    try:
+        await db.activity_likes.insert_one({
+            "activity_id": activity_id,
+            "user_id": user_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
         return {"success": True, "action": "liked"}
+    await db.activity_feed.update_one({"id": activity_id}, {"$inc": {"likes": 1}})
+    return {"success": True, "action": "liked"}
+
+
+@router.post("/activity/liked")
+async def check_liked_activities(request: LikedCheckRequest):
+    """Which of a page of activities the user has liked"""
+    liked = await _liked_ids(request.user_id, request.activity_ids[:100])
+    return {"liked": sorted(liked)}
+
+
+async def migrate_likes() -> Dict[str, int]:
+    """Move legacy liked_by arrays into activity_likes and recount"""
+    migrated = 0
+    cursor = db.activity_feed.find(
+        {"liked_by": {"$exists": True}},
+        {"_id": 0, "id": 1, "liked_by": 1}
+    ).batch_size(LIKES_MIGRATION_BATCH_SIZE)
+    
+    batch: List[Dict[str, Any]] = []
+    async for activity in cursor:
+        batch.append(activity)
+        if len(batch) >= LIKES_MIGRATION_BATCH_SIZE:
+            migrated += await _migrate_likes_batch(batch)
+            batch = []
+    if batch:
+        migrated += await _migrate_likes_batch(batch)
+    return {"activities_migrated": migrated}
+
+
+async def _migrate_likes_batch(activities: List[Dict[str, Any]]) -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    likes = [
+        {"activity_id": a["id"], "user_id": user_id, "created_at": now}
+        for a in activities for user_id in set(a.get("liked_by") or [])
+    ]
+    if likes:
+        try:
+            await db.activity_likes.insert_many(likes, ordered=False)
+        except BulkWriteError as e:
+            if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                raise
+    
+    # Recount from the likes collection, which now holds old and new likes
+    counts = {
+        row["_id"]: row["count"]
+        async for row in db.activity_likes.aggregate([
+            {"$match": {"activity_id": {"$in": [a["id"] for a in activities]}}},
+            {"$group": {"_id": "$activity_id", "count": {"$sum": 1}}}
+        ])
+    }
+    await db.activity_feed.bulk_write([
+        UpdateOne({"id": a["id"]}, {"$set": {"likes": counts.get(a["id"], 0)}, "$unset": {"liked_by": ""}})
+        for a in activities
+    ], ordered=False)
+    return len(activities)
+
+
+@router.post("/admin/migrate-likes")
+async def admin_migrate_likes():
+    """Admin endpoint to move legacy liked_by arrays into activity_likes"""
+    result = await migrate_likes()
+    return {"success": True, **result}
 
 
 # ========== NOTIFICATIONS ==========
 
+# Unread counts live in notification_counters, moved by the same writes that
+# create or read notifications, and are cached briefly for badge polling.
+# Read notifications get a read_at date and expire through a TTL index.
+
+READ_NOTIFICATION_TTL_DAYS = 30
+UNREAD_CACHE_TTL_SECONDS = 10.0
+
+_unread_cache: Dict[str, Tuple[float, int]] = {}
+
+
+async def _adjust_unread(user_id: str, delta: int) -> int:
+    """Move a user's unread counter and return the new value"""
+    counter = await db.notification_counters.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {"unread": delta}},
+        projection={"_id": 0, "unread": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    unread = max(counter["unread"], 0)
+    _unread_cache[user_id] = (time.monotonic(), unread)
+    return unread
+
+
+async def _unread_count(user_id: str) -> int:
+    cached = _unread_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < UNREAD_CACHE_TTL_SECONDS:
+        return cached[1]
+    counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0, "unread": 1})
+    unread = max(counter["unread"], 0) if counter else 0
+    _unread_cache[user_id] = (time.monotonic(), unread)
+    return unread
+
+
+async def _create_notification(notification: Dict[str, Any], category: Optional[str] = None):
+    """Store a notification, count it as unread and push it to the player's stream"""
+    user_id = notification["user_id"]
+    prefs = (await load_preferences(db, [user_id]))[user_id]
+    if not category_enabled(prefs, category):
+        return
+    notification["silent"] = is_silent(prefs, datetime.now(timezone.utc).hour)
+    await db.notifications.insert_one(notification)
+    await _adjust_unread(notification["user_id"], 1)
+    if not notification.get("silent"):
+        await publish_to_user(notification["user_id"], "notification", notification)
+
+
+async def rebuild_notification_counters() -> Dict[str, int]:
+    """Recount unread notifications for every user and date legacy read ones for the TTL"""
+    dated = await db.notifications.update_many(
+        {"is_read": True, "read_at": {"$exists": False}},
+        {"$currentDate": {"read_at": True}}
+    )
+    await db.notification_counters.update_many({}, {"$set": {"unread": 0}})
+    await db.notifications.aggregate([
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}},
+        {"$project": {"_id": 0, "user_id": "$_id", "unread": 1}},
+        {"$merge": {"into": "notification_counters", "on": "user_id", "whenMatched": "merge"}}
+    ], allowDiskUse=True).to_list(None)
+    _unread_cache.clear()
+    return {
+        "counters": await db.notification_counters.count_documents({}),
+        "read_dated": dated.modified_count
+    }
+
+
+@router.post("/admin/rebuild-notification-counters")
+async def admin_rebuild_notification_counters():
+    """Admin endpoint to recount every user's unread notifications"""
+    result = await rebuild_notification_counters()
+    return {"success": True, **result}
+
+
 @router.get("/notifications/{user_id}")
 async def get_notifications(user_id: str, limit: int = 50, unread_only: bool = False):
     """Get user notifications"""
@@ -603,21 +1087,48 @@ async def get_notifications(user_id: str, limit: int = 50, unread_only: bool = F
         {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
     
-    unread_count = await db.notifications.count_documents({
-        "user_id": user_id,
-        "is_read": False
-    })
-    
-    return {"notifications": notifications, "unread_count": unread_count}
+    return {"notifications": notifications, "unread_count": await _unread_count(user_id)}
+
+
+@router.get("/notifications/{user_id}/count")
+async def get_unread_notification_count(user_id: str):
+    """Unread badge count, cheap enough to poll"""
+    return {"unread_count": await _unread_count(user_id)}
+
+
+@router.get("/notifications/{user_id}/preferences")
+async def get_notification_preferences(user_id: str):
+    """Player's notification settings, defaults for anything never set"""
+    preferences = await load_preferences(db, [user_id])
+    return {"preferences": preferences[user_id]}
+
+
+@router.put("/notifications/{user_id}/preferences")
+async def update_notification_preferences(user_id: str, request: NotificationPreferencesRequest):
+    """Change some of a player's notification settings"""
+    changes = request.model_dump(exclude_unset=True)
+    for field, value in changes.items():
+        if value is None and PREFERENCE_DEFAULTS[field] is not None:
+            raise HTTPException(status_code=400, detail=f"{field} cannot be null")
+    if changes:
+        await db.notification_preferences.update_one(
+            {"user_id": user_id},
+            {"$set": changes},
+            upsert=True
+        )
+    preferences = await load_preferences(db, [user_id])
+    return {"success": True, "preferences": preferences[user_id]}
 
 
 @router.post("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, user_id: str):
     """Mark notification as read"""
-    await db.notifications.update_one(
-        {"id": notification_id, "user_id": user_id},
-        {"$set": {"is_read": True}}
+    result = await db.notifications.update_one(
+        {"id": notification_id, "user_id": user_id, "is_read": False},
+        {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await _adjust_unread(user_id, -1)
     return {"success": True}
 
 
@@ -626,8 +1137,10 @@ async def mark_all_notifications_read(user_id: str):
     """Mark all notifications as read"""
     result = await db.notifications.update_many(
         {"user_id": user_id, "is_read": False},
-        {"$set": {"is_read": True}}
+        {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await _adjust_unread(user_id, -result.modified_count)
     return {"success": True, "marked_count": result.modified_count}
 
 
@@ -635,8 +1148,102 @@ async def mark_all_notifications_read(user_id: str):
 async def clear_notifications(user_id: str, older_than_days: int = 7):
     """Clear old notifications"""
     cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
-    result = await db.notifications.delete_many({
+    # Unread ones separately, so the counter drops by exactly what was removed
+    unread = await db.notifications.delete_many({
         "user_id": user_id,
+        "is_read": False,
         "created_at": {"$lt": cutoff.isoformat()}
     })
-    return {"success": True, "deleted_count": result.deleted_count}
+    if unread.deleted_count:
+        await _adjust_unread(user_id, -unread.deleted_count)
+    read = await db.notifications.delete_many({
+        "user_id": user_id,
+        "created_at": {"$lt": cutoff.isoformat()}
+    })
+    return {"success": True, "deleted_count": unread.deleted_count + read.deleted_count}
+
+
+# ========== LIVE PLAYER STREAM ==========
+
+# One server-sent event stream per player carries new notifications, gifts and
+# friend requests as they are created. Event ids are "created_at|id", so a
+# reconnect's Last-Event-ID header tells us what to replay from the database.
+# Documents are stamped before they are written and published, so an event can
+# arrive after a newer one; replay starts STREAM_REPLAY_GRACE_SECONDS earlier
+# and clients drop events whose id they have already seen.
+
+STREAM_CATCH_UP_LIMIT = 50
+STREAM_REPLAY_GRACE_SECONDS = 120
+PLAYER_STREAM_QUEUE_SIZE = 64 + 3 * STREAM_CATCH_UP_LIMIT
+
+
+def _player_frame(event: str, doc: Dict[str, Any]) -> str:
+    return format_sse(event, doc, event_id(doc))
+
+
+async def _missed_events(user_id: str, since: str) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+    """Events created for the player since the given time, oldest first; None if too many to replay"""
+    sources = [
+        ("notification", db.notifications, {"user_id": user_id, "silent": {"$ne": True}}),
+        ("gift", db.gifts, {"to_user_id": user_id, "status": "pending"}),
+        ("friend_request", db.friend_requests, {"to_user_id": user_id, "status": "pending"}),
+    ]
+    events = []
+    for event, collection, query in sources:
+        docs = await collection.find(
+            {**query, "created_at": {"$gte": since}},
+            {"_id": 0}
+        ).sort("created_at", 1).limit(STREAM_CATCH_UP_LIMIT + 1).to_list(STREAM_CATCH_UP_LIMIT + 1)
+        if len(docs) > STREAM_CATCH_UP_LIMIT:
+            return None
+        events.extend((event, doc) for doc in docs)
+    events.sort(key=lambda e: (e[1]["created_at"], e[1]["id"]))
+    return events
+
+
+@router.get("/stream/{user_id}")
+async def stream_player_events(user_id: str, last_event_id: Optional[str] = Header(None)):
+    """Stream new notifications, gifts and friend requests; replays on reconnect overlap, so dedupe by id"""
+    subscriber = Subscriber(PLAYER_STREAM_QUEUE_SIZE)
+    held: Optional[List[Dict[str, Any]]] = []  # live events arriving while we replay
+    
+    def on_event(payload: Dict[str, Any]):
+        if held is not None:
+            held.append(payload)
+        else:
+            subscriber.offer(_player_frame(payload["event"], payload["data"]))
+    
+    # Subscribe before replaying so nothing created in between is lost
+    unsubscribe = get_pubsub().subscribe(user_channel(user_id), on_event)
+    replayed = set()
+    if last_event_id:
+        since, _, last_id = last_event_id.partition("|")
+        try:
+            replay_from = datetime.fromisoformat(since) - timedelta(seconds=STREAM_REPLAY_GRACE_SECONDS)
+        except ValueError:
+            unsubscribe()
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+        try:
+            missed = await _missed_events(user_id, replay_from.isoformat())
+        except Exception:
+            unsubscribe()
+            raise
+        if missed is None:
+            # Too far behind - the client refetches its lists instead
+            subscriber.offer(format_sse("resync", {"reason": "too_many_missed"}))
+        else:
+            for event, doc in missed:
+                if doc["id"] != last_id:
+                    replayed.add(doc["id"])
+                    subscriber.offer(_player_frame(event, doc))
+    
+    pending, held = held, None
+    for payload in pending:
+        if payload["data"]["id"] not in replayed:
+            on_event(payload)
+    
+    return StreamingResponse(
+        sse_stream(subscriber, unsubscribe),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
@@ -0,0 +1,67 @@
+# ========== GO FISH! PREFIX SEARCH HELPERS ==========
+# Normalized search terms so name lookups are anchored, indexed and ReDoS-safe
+
+from typing import Any, Callable, Dict, List, Optional
+from pymongo import UpdateOne
+import re
+
+SEARCH_FIELD = "search_terms"
+BACKFILL_BATCH_SIZE = 1000
+
+_WORD_SPLIT = re.compile(r"[^\w]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    """Case-fold and collapse whitespace"""
+    return " ".join((text or "").casefold().split())
+
+
+def search_terms(*values: Optional[str]) -> List[str]:
+    """Every normalized value plus each of its words, for a multikey prefix index"""
+    terms = []
+    for value in values:
+        full = normalize(value)
+        if not full:
+            continue
+        terms.append(full)
+        terms.extend(word for word in _WORD_SPLIT.split(full) if word)
+    return list(dict.fromkeys(terms))
+
+
+def prefix_filter(query: str) -> Dict[str, Any]:
+    """Anchored, escaped prefix match on the search terms"""
+    return {SEARCH_FIELD: {"$regex": "^" + re.escape(normalize(query))}}
+
+
+def rank_matches(docs: List[Dict[str, Any]], query: str, fields: List[str],
+                 tiebreak: Callable[[Dict[str, Any]], Any]) -> List[Dict[str, Any]]:
+    """Order candidates: exact match, then whole-value prefix, then word prefix"""
+    needle = normalize(query)
+
+    def score(doc: Dict[str, Any]) -> int:
+        values = [normalize(doc.get(field)) for field in fields]
+        if needle in values:
+            return 0
+        if any(value.startswith(needle) for value in values):
+            return 1
+        return 2
+
+    return sorted(docs, key=lambda doc: (score(doc), tiebreak(doc)))
+
+
+async def backfill_search_terms(collection, fields: List[str]):
+    """Populate search terms on documents written before the field existed"""
+    cursor = collection.find(
+        {SEARCH_FIELD: {"$exists": False}},
+        {"_id": 1, **{field: 1 for field in fields}}
+    ).batch_size(BACKFILL_BATCH_SIZE)
+
+    batch = []
+    async for doc in cursor:
+        terms = search_terms(*(doc.get(field) for field in fields))
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {SEARCH_FIELD: terms}}))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.bulk_write(batch, ordered=False)
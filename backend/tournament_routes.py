@@ -2,14 +2,26 @@
 # Competitive fishing tournaments with rewards and rankings
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import bisect
+import logging
 import uuid
 import os
+import time
+
+from notification_dispatcher import dispatcher
+from realtime import SSE_HEADERS, Subscriber, format_sse, sse_stream
+from score_audit import TIMELINE_LIMIT, audit_tournament
 
 router = APIRouter(prefix="/api/tournaments", tags=["tournaments"])
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL')
@@ -17,6 +29,23 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME')]
 
 
+@router.on_event("startup")
+async def ensure_tournament_indexes():
+    """Create indexes the tournament endpoints rely on"""
+    await db.tournament_entries.create_index(
+        [("tournament_id", 1), ("user_id", 1)],
+        unique=True
+    )
+    await db.tournament_entries.create_index(
+        [("tournament_id", 1), ("bracket_id", 1), ("score", -1), ("biggest_fish", -1), ("id", 1)]
+    )
+    await db.tournament_brackets.create_index([("tournament_id", 1), ("skill_tier", 1), ("size", 1)])
+    await db.tournament_score_timeline.create_index("entry_id", unique=True)
+    await db.tournament_results.create_index([("user_id", 1), ("ended_at", -1)])
+    await db.tournaments.create_index([("status", 1), ("end_time", 1)])
+    await db.player_tournament_stats.create_index("user_id", unique=True)
+
+
 # ========== REQUEST/RESPONSE MODELS ==========
 
 class CreateTournamentRequest(BaseModel):
@@ -27,6 +56,8 @@ class CreateTournamentRequest(BaseModel):
     entry_fee: int = 0
     entry_currency: str = "coins"
     max_participants: int = 1000
+    bracket_size: Optional[int] = None  # split joins into independently ranked brackets
+    bracket_skill: str = "level"  # level, high_score
     fish_requirements: List[str] = Field(default_factory=list)
     stage_requirements: List[int] = Field(default_factory=list)
 
@@ -43,6 +74,7 @@ class UpdateScoreRequest(BaseModel):
     biggest_fish: int = 0
     perfect_catches: int = 0
     combo_max: int = 0
+    stage: Optional[int] = None
 
 
 class TournamentRewardTier(BaseModel):
@@ -52,6 +84,135 @@ class TournamentRewardTier(BaseModel):
     trophy_type: str = "bronze"
 
 
+# ========== LEADERBOARD ORDERING ==========
+
+# Score, then biggest fish, then entry id so every participant has an exact rank
+LEADERBOARD_SORT = [("score", -1), ("biggest_fish", -1), ("id", 1)]
+LEADERBOARD_SORT_REVERSED = [("score", 1), ("biggest_fish", 1), ("id", -1)]
+
+
+def _ranked_ahead_of(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Query matching every entry ranked above the given one in its bracket"""
+    return {
+        "tournament_id": entry["tournament_id"],
+        "bracket_id": entry.get("bracket_id"),
+        "$or": [
+            {"score": {"$gt": entry["score"]}},
+            {"score": entry["score"], "biggest_fish": {"$gt": entry["biggest_fish"]}},
+            {"score": entry["score"], "biggest_fish": entry["biggest_fish"], "id": {"$lt": entry["id"]}}
+        ]
+    }
+
+
+def _ranked_behind(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Query matching every entry ranked below the given one in its bracket"""
+    return {
+        "tournament_id": entry["tournament_id"],
+        "bracket_id": entry.get("bracket_id"),
+        "$or": [
+            {"score": {"$lt": entry["score"]}},
+            {"score": entry["score"], "biggest_fish": {"$lt": entry["biggest_fish"]}},
+            {"score": entry["score"], "biggest_fish": entry["biggest_fish"], "id": {"$gt": entry["id"]}}
+        ]
+    }
+
+
+# ========== BRACKETS ==========
+
+# Skill thresholds - players are only bracketed with others in the same band
+BRACKET_SKILL_BANDS = {
+    "level": [10, 25, 50, 100],
+    "high_score": [5000, 25000, 100000, 500000],
+}
+
+
+def _skill_tier(user: Optional[Dict[str, Any]], skill: str) -> int:
+    """Skill band index for a player"""
+    bands = BRACKET_SKILL_BANDS.get(skill, BRACKET_SKILL_BANDS["level"])
+    value = (user or {}).get(skill, 0)
+    return bisect.bisect_right(bands, value)
+
+
+async def _assign_bracket(tournament: Dict[str, Any], user_id: str) -> str:
+    """Seat a player in an open bracket of their skill band, opening a new one if all are full"""
+    skill = tournament.get("bracket_skill", "level")
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, skill: 1})
+    tier = _skill_tier(user, skill)
+    
+    bracket = await db.tournament_brackets.find_one_and_update(
+        {"tournament_id": tournament["id"], "skill_tier": tier, "size": {"$lt": tournament["bracket_size"]}},
+        {"$inc": {"size": 1}},
+        sort=[("size", -1)],
+        projection={"_id": 0, "id": 1}
+    )
+    if bracket:
+        return bracket["id"]
+    
+    bracket = {
+        "id": str(uuid.uuid4()),
+        "tournament_id": tournament["id"],
+        "skill_tier": tier,
+        "size": 1,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.tournament_brackets.insert_one(bracket)
+    return bracket["id"]
+
+
+# ========== ACTIVE TOURNAMENT CACHE ==========
+
+# Lobby cards only need these; the full document is served by GET /{tournament_id}
+TOURNAMENT_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "description": 1,
+    "tournament_type": 1,
+    "status": 1,
+    "start_time": 1,
+    "end_time": 1,
+    "entry_fee": 1,
+    "entry_currency": 1,
+    "max_participants": 1,
+    "current_participants": 1,
+    "bracket_size": 1,
+    "reward_tiers": {"$slice": 3},  # card preview; the full list comes with the details
+}
+
+ACTIVE_CACHE_TTL_SECONDS = 15.0
+
+_active_cache: Dict[str, Any] = {"tournaments": [], "loaded_at": None}
+_active_cache_lock = asyncio.Lock()
+
+
+def _invalidate_active_tournaments():
+    """Drop the cached lobby list so the next read reloads it"""
+    _active_cache["loaded_at"] = None
+
+
+async def _active_tournament_summaries() -> List[Dict[str, Any]]:
+    """Active tournament summaries, reloaded on lifecycle events or after the TTL"""
+    loaded_at = _active_cache["loaded_at"]
+    if loaded_at is not None and time.monotonic() - loaded_at < ACTIVE_CACHE_TTL_SECONDS:
+        return _active_cache["tournaments"]
+    
+    async with _active_cache_lock:
+        # Another request may have reloaded while we waited
+        loaded_at = _active_cache["loaded_at"]
+        if loaded_at is not None and time.monotonic() - loaded_at < ACTIVE_CACHE_TTL_SECONDS:
+            return _active_cache["tournaments"]
+        
+        now = datetime.now(timezone.utc).isoformat()
+        tournaments = await db.tournaments.find({
+            "status": "active",
+            "end_time": {"$gt": now}
+        }, TOURNAMENT_SUMMARY_PROJECTION).sort("end_time", 1).to_list(100)
+        
+        _active_cache["tournaments"] = tournaments
+        _active_cache["loaded_at"] = time.monotonic()
+        return tournaments
+
+
 # ========== TOURNAMENT CRUD ENDPOINTS ==========
 
 @router.post("/create")
@@ -79,6 +240,8 @@ async def create_tournament(request: CreateTournamentRequest):
         "entry_fee": request.entry_fee,
         "entry_currency": request.entry_currency,
         "max_participants": request.max_participants,
+        "bracket_size": request.bracket_size,
+        "bracket_skill": request.bracket_skill,
         "current_participants": 0,
         "status": "active",
         "rules": {
@@ -94,19 +257,30 @@ async def create_tournament(request: CreateTournamentRequest):
     }
     
     await db.tournaments.insert_one(tournament)
+    _invalidate_active_tournaments()
     return {"success": True, "tournament_id": tournament["id"], "tournament": {k: v for k, v in tournament.items() if k != "_id"}}
 
 
 @router.get("/active")
 async def get_active_tournaments():
-    """Get all active tournaments"""
+    """Get all active tournaments (summary view)"""
+    tournaments = await _active_tournament_summaries()
     now = datetime.now(timezone.utc).isoformat()
-    tournaments = await db.tournaments.find({
-        "status": "active",
-        "end_time": {"$gt": now}
-    }, {"_id": 0}).to_list(100)
+    return {"tournaments": [t for t in tournaments if t["end_time"] > now]}
+
+
+@router.post("/{tournament_id}/activate")
+async def activate_tournament(tournament_id: str):
+    """Start a scheduled tournament"""
+    result = await db.tournaments.update_one(
+        {"id": tournament_id, "status": "upcoming"},
+        {"$set": {"status": "active", "activated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="Tournament is not upcoming")
     
-    return {"tournaments": tournaments}
+    _invalidate_active_tournaments()
+    return {"success": True}
 
 
 @router.get("/{tournament_id}")
@@ -118,19 +292,193 @@ async def get_tournament(tournament_id: str):
     return tournament
 
 
+async def _leaderboard_filter(tournament_id: str, bracket_id: Optional[str] = None,
+                              user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Entries one leaderboard ranks: the given bracket, else the player's own bracket"""
+    if bracket_id is None and user_id:
+        entry = await db.tournament_entries.find_one(
+            {"tournament_id": tournament_id, "user_id": user_id},
+            {"_id": 0, "bracket_id": 1}
+        )
+        bracket_id = entry.get("bracket_id") if entry else None
+    if bracket_id is not None:
+        return {"tournament_id": tournament_id, "bracket_id": bracket_id}
+    
+    tournament = await db.tournaments.find_one({"id": tournament_id}, {"_id": 0, "bracket_size": 1})
+    if tournament and tournament.get("bracket_size"):
+        # Never rank the whole field - every read stays within one bracket
+        raise HTTPException(status_code=400, detail="bracket_id or an entrant's user_id is required")
+    return {"tournament_id": tournament_id, "bracket_id": None}
+
+
 @router.get("/{tournament_id}/leaderboard")
-async def get_tournament_leaderboard(tournament_id: str, limit: int = 100):
-    """Get tournament leaderboard"""
+async def get_tournament_leaderboard(tournament_id: str, limit: int = 100, bracket_id: Optional[str] = None,
+                                     user_id: Optional[str] = None):
+    """Get tournament leaderboard (a bracket's, or the player's own bracket's, when bracketed)"""
+    query = await _leaderboard_filter(tournament_id, bracket_id, user_id)
     entries = await db.tournament_entries.find(
-        {"tournament_id": tournament_id},
+        query,
         {"_id": 0}
-    ).sort("score", -1).limit(limit).to_list(limit)
+    ).sort(LEADERBOARD_SORT).limit(limit).to_list(limit)
     
     # Add ranks
     for i, entry in enumerate(entries):
         entry["rank"] = i + 1
     
-    return {"leaderboard": entries}
+    return {"leaderboard": entries, "bracket_id": query.get("bracket_id")}
+
+
+@router.get("/{tournament_id}/leaderboard/around/{user_id}")
+async def get_leaderboard_around_player(tournament_id: str, user_id: str, radius: int = 5):
+    """Get the players ranked just above and below a participant"""
+    radius = max(1, min(radius, 50))
+    entry = await db.tournament_entries.find_one({
+        "tournament_id": tournament_id,
+        "user_id": user_id
+    }, {"_id": 0})
+    if not entry:
+        raise HTTPException(status_code=404, detail="Not participating in this tournament")
+    
+    # Both windows walk the leaderboard index outward from the player
+    ahead_count, above, below = await asyncio.gather(
+        db.tournament_entries.count_documents(_ranked_ahead_of(entry)),
+        db.tournament_entries.find(_ranked_ahead_of(entry), {"_id": 0})
+            .sort(LEADERBOARD_SORT_REVERSED).limit(radius).to_list(radius),
+        db.tournament_entries.find(_ranked_behind(entry), {"_id": 0})
+            .sort(LEADERBOARD_SORT).limit(radius).to_list(radius)
+    )
+    
+    rank = ahead_count + 1
+    above.reverse()
+    for i, row in enumerate(above):
+        row["rank"] = rank - len(above) + i
+    entry["rank"] = rank
+    for i, row in enumerate(below):
+        row["rank"] = rank + 1 + i
+    
+    return {"rank": rank, "leaderboard": above + [entry] + below}
+
+
+# ========== LIVE LEADERBOARD PUSH ==========
+
+LIVE_TOP_N = 20
+LIVE_TICK_SECONDS = 2.0
+
+
+class LeaderboardHub:
+    """Reads one tournament's standings once per tick and pushes diffs to every subscriber"""
+    
+    def __init__(self, query: Dict[str, Any]):
+        self.query = query
+        self.tournament_id = query["tournament_id"]
+        self.bracket_id = query.get("bracket_id")
+        self.subscribers: Dict[Subscriber, Optional[str]] = {}
+        self.last_seen: Dict[Subscriber, Any] = {}
+        self.top: List[list] = []
+        self.task: Optional[asyncio.Task] = None
+    
+    def subscribe(self, user_id: Optional[str]) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers[subscriber] = user_id
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return subscriber
+    
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.pop(subscriber, None)
+        self.last_seen.pop(subscriber, None)
+    
+    async def _run(self):
+        try:
+            while self.subscribers:
+                try:
+                    await self._tick()
+                except Exception as e:
+                    logger.error(f"Live leaderboard tick failed for {self.tournament_id}: {e}")
+                await asyncio.sleep(LIVE_TICK_SECONDS)
+        finally:
+            key = (self.tournament_id, self.bracket_id)
+            if _leaderboard_hubs.get(key) is self and not self.subscribers:
+                del _leaderboard_hubs[key]
+    
+    async def _ranks(self, rows: List[Dict[str, Any]]) -> Dict[str, tuple]:
+        """(rank, score) of every subscribed player, counted on the leaderboard index"""
+        ranks = {row["user_id"]: (rank, row["score"]) for rank, row in enumerate(rows, 1)}
+        others = {u for u in self.subscribers.values() if u and u not in ranks}
+        if not others:
+            return ranks
+        entries = await db.tournament_entries.find(
+            {**self.query, "user_id": {"$in": list(others)}},
+            {"_id": 0, "id": 1, "tournament_id": 1, "bracket_id": 1, "user_id": 1, "score": 1, "biggest_fish": 1}
+        ).to_list(None)
+        ahead = await asyncio.gather(*(
+            db.tournament_entries.count_documents(_ranked_ahead_of(entry)) for entry in entries
+        ))
+        for entry, count in zip(entries, ahead):
+            ranks[entry["user_id"]] = (count + 1, entry["score"])
+        return ranks
+    
+    async def _tick(self):
+        # Only the top-N is read; subscribers outside it get an indexed rank count
+        rows, total = await asyncio.gather(
+            db.tournament_entries.find(
+                self.query,
+                {"_id": 0, "user_id": 1, "username": 1, "score": 1, "biggest_fish": 1}
+            ).sort(LEADERBOARD_SORT).limit(LIVE_TOP_N).to_list(LIVE_TOP_N),
+            db.tournament_entries.count_documents(self.query)
+        )
+        
+        ranks = await self._ranks(rows)
+        top = [
+            [rank, row["user_id"], row["username"], row["score"], row["biggest_fish"]]
+            for rank, row in enumerate(rows, 1)
+        ]
+        changed = [row for i, row in enumerate(top) if i >= len(self.top) or self.top[i] != row]
+        self.top = top
+        
+        for subscriber, user_id in list(self.subscribers.items()):
+            me = ranks.get(user_id) if user_id else None
+            if subscriber not in self.last_seen:
+                frame = format_sse("snapshot", {"top": top, "me": me, "total": total})
+            else:
+                diff = {}
+                if changed:
+                    diff["top"] = changed
+                    diff["size"] = len(top)
+                if me != self.last_seen[subscriber]:
+                    diff["me"] = me
+                if not diff:
+                    continue
+                frame = format_sse("diff", diff)
+            if subscriber.offer(frame):
+                self.last_seen[subscriber] = me
+            else:
+                self.unsubscribe(subscriber)
+
+
+_leaderboard_hubs: Dict[tuple, LeaderboardHub] = {}
+
+
+@router.get("/{tournament_id}/leaderboard/live")
+async def stream_tournament_leaderboard(tournament_id: str, user_id: Optional[str] = None,
+                                        bracket_id: Optional[str] = None):
+    """Stream top-N leaderboard changes and the subscriber's own rank"""
+    tournament = await db.tournaments.find_one({"id": tournament_id}, {"_id": 0, "id": 1})
+    if not tournament:
+        raise HTTPException(status_code=404, detail="Tournament not found")
+    
+    query = await _leaderboard_filter(tournament_id, bracket_id, user_id)
+    key = (tournament_id, query.get("bracket_id"))
+    hub = _leaderboard_hubs.get(key)
+    if hub is None:
+        hub = _leaderboard_hubs[key] = LeaderboardHub(query)
+    subscriber = hub.subscribe(user_id)
+    
+    return StreamingResponse(
+        sse_stream(subscriber, lambda: hub.unsubscribe(subscriber)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
 
 
 # ========== TOURNAMENT PARTICIPATION ==========
@@ -138,45 +486,54 @@ async def get_tournament_leaderboard(tournament_id: str, limit: int = 100):
 @router.post("/{tournament_id}/join")
 async def join_tournament(tournament_id: str, request: JoinTournamentRequest):
     """Join a tournament"""
-    tournament = await db.tournaments.find_one({"id": tournament_id}, {"_id": 0})
+    tournament = await db.tournaments.find_one(
+        {"id": tournament_id},
+        {"_id": 0, "id": 1, "status": 1, "entry_fee": 1, "entry_currency": 1, "bracket_size": 1, "bracket_skill": 1}
+    )
     if not tournament:
         raise HTTPException(status_code=404, detail="Tournament not found")
     
     if tournament["status"] != "active":
         raise HTTPException(status_code=400, detail="Tournament is not active")
     
-    if tournament["current_participants"] >= tournament["max_participants"]:
+    # Reserve a slot - the capacity check and increment happen in one write
+    reserved = await db.tournaments.update_one(
+        {
+            "id": tournament_id,
+            "status": "active",
+            "$expr": {"$lt": ["$current_participants", "$max_participants"]}
+        },
+        {"$inc": {"current_participants": 1}}
+    )
+    if reserved.modified_count == 0:
         raise HTTPException(status_code=400, detail="Tournament is full")
     
-    # Check if already joined
-    existing = await db.tournament_entries.find_one({
-        "tournament_id": tournament_id,
-        "user_id": request.user_id
-    })
-    if existing:
-        raise HTTPException(status_code=400, detail="Already joined this tournament")
-    
-    # Deduct entry fee if applicable
-    if tournament["entry_fee"] > 0:
-        user = await db.users.find_one({"id": request.user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        currency_field = "coins" if tournament["entry_currency"] == "coins" else "gems"
-        if user.get(currency_field, 0) < tournament["entry_fee"]:
-            raise HTTPException(status_code=400, detail=f"Insufficient {tournament['entry_currency']}")
-        
-        await db.users.update_one(
-            {"id": request.user_id},
-            {"$inc": {currency_field: -tournament["entry_fee"]}}
+    # Deduct entry fee if applicable, guarded on the balance covering it
+    fee = tournament["entry_fee"]
+    currency_field = "coins" if tournament["entry_currency"] == "coins" else "gems"
+    if fee > 0:
+        debited = await db.users.update_one(
+            {"id": request.user_id, currency_field: {"$gte": fee}},
+            {"$inc": {currency_field: -fee}}
         )
+        if debited.modified_count == 0:
+            await _release_slot(tournament_id)
+            user = await db.users.find_one({"id": request.user_id}, {"_id": 0, "id": 1})
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            raise HTTPException(status_code=400, detail=f"Insufficient {tournament['entry_currency']}")
+    
+    bracket_id = None
+    if tournament.get("bracket_size"):
+        bracket_id = await _assign_bracket(tournament, request.user_id)
     
-    # Create entry
+    # Create entry - the unique (tournament_id, user_id) index rejects duplicates
     entry = {
         "id": str(uuid.uuid4()),
         "tournament_id": tournament_id,
         "user_id": request.user_id,
         "username": request.username,
+        "bracket_id": bracket_id,
         "score": 0,
         "fish_caught": 0,
         "biggest_fish": 0,
@@ -186,15 +543,28 @@ async def join_tournament(tournament_id: str, request: JoinTournamentRequest):
         "last_updated": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.tournament_entries.insert_one(entry)
+    try:
+        await db.tournament_entries.insert_one(entry)
+    except DuplicateKeyError:
+        await _release_slot(tournament_id)
+        if bracket_id:
+            await db.tournament_brackets.update_one({"id": bracket_id}, {"$inc": {"size": -1}})
+        if fee > 0:
+            await db.users.update_one(
+                {"id": request.user_id},
+                {"$inc": {currency_field: fee}}
+            )
+        raise HTTPException(status_code=400, detail="Already joined this tournament")
     
-    # Update participant count
+    return {"success": True, "entry": {k: v for k, v in entry.items() if k != "_id"}}
+
+
+async def _release_slot(tournament_id: str):
+    """Give back a reserved participant slot after a failed join"""
     await db.tournaments.update_one(
-        {"id": tournament_id},
-        {"$inc": {"current_participants": 1}}
+        {"id": tournament_id, "current_participants": {"$gt": 0}},
+        {"$inc": {"current_participants": -1}}
     )
-    
-    return {"success": True, "entry": {k: v for k, v in entry.items() if k != "_id"}}
 
 
 @router.post("/{tournament_id}/update-score")
@@ -220,6 +590,7 @@ async def update_tournament_score(tournament_id: str, request: UpdateScoreReques
         raise HTTPException(status_code=404, detail="Not participating in this tournament")
     
     # Update entry
+    now = datetime.now(timezone.utc)
     update_data = {
         "$inc": {
             "score": request.score_delta,
@@ -231,21 +602,32 @@ async def update_tournament_score(tournament_id: str, request: UpdateScoreReques
             "combo_max": request.combo_max
         },
         "$set": {
-            "last_updated": datetime.now(timezone.utc).isoformat()
+            "last_updated": now.isoformat()
         }
     }
+    if request.stage is not None:
+        update_data["$max"]["max_stage"] = request.stage
     
-    await db.tournament_entries.update_one(
-        {"id": entry["id"]},
-        update_data
+    # Record the update on the entry's audit timeline alongside the score change
+    await asyncio.gather(
+        db.tournament_entries.update_one({"id": entry["id"]}, update_data),
+        db.tournament_score_timeline.update_one(
+            {"entry_id": entry["id"]},
+            {
+                "$setOnInsert": {"tournament_id": tournament_id},
+                "$push": {
+                    "t": {"$each": [now.timestamp()], "$slice": -TIMELINE_LIMIT},
+                    "delta": {"$each": [request.score_delta], "$slice": -TIMELINE_LIMIT},
+                    "fish": {"$each": [request.fish_caught], "$slice": -TIMELINE_LIMIT}
+                }
+            },
+            upsert=True
+        )
     )
     
     # Get updated entry with rank
     updated_entry = await db.tournament_entries.find_one({"id": entry["id"]}, {"_id": 0})
-    rank_count = await db.tournament_entries.count_documents({
-        "tournament_id": tournament_id,
-        "score": {"$gt": updated_entry["score"]}
-    })
+    rank_count = await db.tournament_entries.count_documents(_ranked_ahead_of(updated_entry))
     updated_entry["rank"] = rank_count + 1
     
     return {"success": True, "entry": updated_entry}
@@ -263,13 +645,13 @@ async def get_my_tournament_entry(tournament_id: str, user_id: str):
         return {"joined": False}
     
     # Calculate rank
-    rank_count = await db.tournament_entries.count_documents({
-        "tournament_id": tournament_id,
-        "score": {"$gt": entry["score"]}
-    })
+    rank_count = await db.tournament_entries.count_documents(_ranked_ahead_of(entry))
     entry["rank"] = rank_count + 1
     
-    total = await db.tournament_entries.count_documents({"tournament_id": tournament_id})
+    total = await db.tournament_entries.count_documents({
+        "tournament_id": tournament_id,
+        "bracket_id": entry.get("bracket_id")
+    })
     entry["total_participants"] = total
     
     return {"joined": True, "entry": entry}
@@ -277,6 +659,9 @@ async def get_my_tournament_entry(tournament_id: str, user_id: str):
 
 # ========== TOURNAMENT COMPLETION ==========
 
+FINALIZE_CHUNK_SIZE = 1000
+
+
 @router.post("/{tournament_id}/finalize")
 async def finalize_tournament(tournament_id: str):
     """Finalize tournament and distribute rewards"""
@@ -287,15 +672,31 @@ async def finalize_tournament(tournament_id: str):
     if tournament["status"] == "ended":
         raise HTTPException(status_code=400, detail="Tournament already finalized")
     
-    # Get final leaderboard
-    entries = await db.tournament_entries.find(
-        {"tournament_id": tournament_id},
+    # Quarantine implausible entries before anything is paid out
+    audit = await audit_tournament(db, tournament_id)
+    
+    # Stream the final standings bracket by bracket; ranks restart in each bracket
+    cursor = db.tournament_entries.find(
+        {"tournament_id": tournament_id, "quarantined": {"$ne": True}},
         {"_id": 0}
-    ).sort([("score", -1), ("biggest_fish", -1)]).to_list(None)
+    ).sort([("bracket_id", 1)] + LEADERBOARD_SORT).batch_size(FINALIZE_CHUNK_SIZE)
     
-    # Create results and assign rewards
+    ended_at = datetime.now(timezone.utc).isoformat()
+    bracketed = bool(tournament.get("bracket_size"))
     results = []
-    for rank, entry in enumerate(entries, 1):
+    reward_updates = []
+    stat_updates = []
+    final_leaderboard = []
+    results_count = 0
+    current_bracket = object()
+    rank = 0
+    
+    async for entry in cursor:
+        if entry.get("bracket_id") != current_bracket:
+            current_bracket = entry.get("bracket_id")
+            rank = 0
+        rank += 1
+        
         # Find applicable reward tier
         reward = {}
         trophy = "participation"
@@ -305,42 +706,111 @@ async def finalize_tournament(tournament_id: str):
                 trophy = tier.get("trophy_type", "participation")
                 break
         
-        result = {
+        results.append({
             "tournament_id": tournament_id,
+            "bracket_id": entry.get("bracket_id"),
             "user_id": entry["user_id"],
             "username": entry["username"],
             "final_rank": rank,
             "final_score": entry["score"],
             "rewards_claimed": False,
             "rewards": reward,
-            "trophy": trophy
-        }
-        results.append(result)
+            "trophy": trophy,
+            "ended_at": ended_at
+        })
+        
+        # Roll lifetime stats forward so history never recomputes them
+        stat_updates.append(UpdateOne(
+            {"user_id": entry["user_id"]},
+            {"$inc": {
+                "total_tournaments": 1,
+                "wins": 1 if rank == 1 else 0,
+                "top_10_finishes": 1 if rank <= 10 else 0,
+                "total_coins_won": reward.get("coins", 0)
+            }},
+            upsert=True
+        ))
         
         # Award rewards to user
-        if reward:
-            update_ops = {}
-            if "coins" in reward:
-                update_ops["$inc"] = update_ops.get("$inc", {})
-                update_ops["$inc"]["coins"] = reward["coins"]
-            if "gems" in reward:
-                update_ops["$inc"] = update_ops.get("$inc", {})
-                update_ops["$inc"]["gems"] = reward["gems"]
-            
-            if update_ops:
-                await db.users.update_one({"id": entry["user_id"]}, update_ops)
-    
-    # Save results
-    if results:
-        await db.tournament_results.insert_many(results)
+        payout = {k: reward[k] for k in ("coins", "gems") if k in reward}
+        if payout:
+            reward_updates.append(UpdateOne({"id": entry["user_id"]}, {"$inc": payout}))
+        
+        # Unbracketed: overall top 100; bracketed: each bracket's winner
+        if len(final_leaderboard) < 100 and (rank == 1 or not bracketed):
+            final_leaderboard.append(entry)
+        
+        if len(results) >= FINALIZE_CHUNK_SIZE:
+            results_count += await _flush_results(results, reward_updates, stat_updates)
+    
+    results_count += await _flush_results(results, reward_updates, stat_updates)
     
     # Update tournament status
     await db.tournaments.update_one(
         {"id": tournament_id},
-        {"$set": {"status": "ended", "final_leaderboard": entries[:100]}}
+        {"$set": {"status": "ended", "ended_at": ended_at, "final_leaderboard": final_leaderboard}}
+    )
+    _invalidate_active_tournaments()
+    
+    # Tell every ranked entrant how they placed, off the request path
+    dispatcher.dispatch(
+        db,
+        {
+            "notification_type": "tournament",
+            "category": "tournament",
+            "title": "{tournament_name} has ended",
+            "message": "You finished #{final_rank} with {final_score} points!",
+            "icon": "🏆",
+            "action_type": "view_tournament_results",
+            "action_data": {"tournament_id": tournament_id}
+        },
+        query={
+            "collection": "tournament_results",
+            "filter": {"tournament_id": tournament_id},
+            "fields": ["final_rank", "final_score"]
+        },
+        context={"tournament_name": tournament["name"]}
     )
     
-    return {"success": True, "results_count": len(results)}
+    return {"success": True, "results_count": results_count, "quarantined": audit["quarantined"]}
+
+
+async def _flush_results(results: List[dict], reward_updates: List[UpdateOne], stat_updates: List[UpdateOne]) -> int:
+    """Write one chunk of finalize output and clear the buffers"""
+    count = len(results)
+    if results:
+        await db.tournament_results.insert_many(results, ordered=False)
+    if reward_updates:
+        await db.users.bulk_write(reward_updates, ordered=False)
+    if stat_updates:
+        await db.player_tournament_stats.bulk_write(stat_updates, ordered=False)
+    results.clear()
+    reward_updates.clear()
+    stat_updates.clear()
+    return count
+
+
+@router.post("/{tournament_id}/audit")
+async def audit_tournament_entries(tournament_id: str):
+    """Run the anti-cheat audit over a tournament's entries"""
+    result = await audit_tournament(db, tournament_id)
+    return {"success": True, **result}
+
+
+@router.post("/{tournament_id}/entries/{user_id}/quarantine")
+async def set_entry_quarantine(tournament_id: str, user_id: str, quarantined: bool = True):
+    """Manually quarantine an entry, or release one the audit flagged"""
+    update = {"quarantined": quarantined}
+    if not quarantined:
+        # Released entries are skipped by later audits
+        update["audit_cleared"] = True
+    result = await db.tournament_entries.update_one(
+        {"tournament_id": tournament_id, "user_id": user_id},
+        {"$set": update}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    return {"success": True, "quarantined": quarantined}
 
 
 @router.get("/{tournament_id}/results/{user_id}")
@@ -366,7 +836,7 @@ async def get_upcoming_tournaments():
     tournaments = await db.tournaments.find({
         "status": "upcoming",
         "start_time": {"$gt": now}
-    }, {"_id": 0}).sort("start_time", 1).limit(10).to_list(10)
+    }, TOURNAMENT_SUMMARY_PROJECTION).sort("start_time", 1).limit(10).to_list(10)
     
     return {"tournaments": tournaments}
 
@@ -419,31 +889,34 @@ async def get_player_tournament_history(user_id: str, limit: int = 20):
     results = await db.tournament_results.find(
         {"user_id": user_id},
         {"_id": 0}
-    ).sort("tournament_id", -1).limit(limit).to_list(limit)
+    ).sort("ended_at", -1).limit(limit).to_list(limit)
+    
+    # Enrich with tournament details in one round trip
+    tournament_ids = list({r["tournament_id"] for r in results})
+    tournaments = await db.tournaments.find(
+        {"id": {"$in": tournament_ids}},
+        {"_id": 0, "id": 1, "name": 1, "tournament_type": 1, "end_time": 1}
+    ).to_list(len(tournament_ids))
+    by_id = {t["id"]: t for t in tournaments}
     
-    # Enrich with tournament details
     for result in results:
-        tournament = await db.tournaments.find_one(
-            {"id": result["tournament_id"]},
-            {"_id": 0, "name": 1, "tournament_type": 1, "end_time": 1}
-        )
+        tournament = by_id.get(result["tournament_id"])
         if tournament:
             result["tournament_name"] = tournament.get("name", "Unknown")
             result["tournament_type"] = tournament.get("tournament_type", "unknown")
-            result["ended_at"] = tournament.get("end_time")
+            result.setdefault("ended_at", tournament.get("end_time"))
     
-    # Calculate stats
-    total_wins = sum(1 for r in results if r["final_rank"] == 1)
-    top_10_finishes = sum(1 for r in results if r["final_rank"] <= 10)
-    total_rewards = sum(r["rewards"].get("coins", 0) for r in results)
+    # Lifetime stats come from the rollup maintained by finalize_tournament
+    stats = await db.player_tournament_stats.find_one({"user_id": user_id}, {"_id": 0})
+    stats = stats or {}
     
     return {
         "history": results,
         "stats": {
-            "total_tournaments": len(results),
-            "wins": total_wins,
-            "top_10_finishes": top_10_finishes,
-            "total_coins_won": total_rewards
+            "total_tournaments": stats.get("total_tournaments", 0),
+            "wins": stats.get("wins", 0),
+            "top_10_finishes": stats.get("top_10_finishes", 0),
+            "total_coins_won": stats.get("total_coins_won", 0)
         }
     }
 
@@ -474,7 +947,9 @@ async def create_daily_tournaments():
         "end_time": (now + timedelta(hours=24)).isoformat(),
         "entry_fee": 0,
         "entry_currency": "coins",
-        "max_participants": 10000,
+        "max_participants": 1000000,
+        "bracket_size": 100,
+        "bracket_skill": "level",
         "current_participants": 0,
         "status": "active",
         "rules": {"min_casts": 5, "scoring": "total_score"},
@@ -515,10 +990,37 @@ async def create_daily_tournaments():
     }
     
     await db.tournaments.insert_one(premium_tournament)
+    _invalidate_active_tournaments()
     
     return {"message": "Daily tournaments created", "tournaments": [free_tournament["id"], premium_tournament["id"]]}
 
 
+@router.post("/admin/rebuild-history-stats")
+async def admin_rebuild_history_stats():
+    """Admin endpoint to rebuild lifetime tournament stats from stored results"""
+    await db.tournament_results.aggregate([
+        {"$group": {
+            "_id": "$user_id",
+            "total_tournaments": {"$sum": 1},
+            "wins": {"$sum": {"$cond": [{"$eq": ["$final_rank", 1]}, 1, 0]}},
+            "top_10_finishes": {"$sum": {"$cond": [{"$lte": ["$final_rank", 10]}, 1, 0]}},
+            "total_coins_won": {"$sum": {"$ifNull": ["$rewards.coins", 0]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id",
+            "total_tournaments": 1,
+            "wins": 1,
+            "top_10_finishes": 1,
+            "total_coins_won": 1
+        }},
+        {"$merge": {"into": "player_tournament_stats", "on": "user_id", "whenMatched": "replace"}}
+    ]).to_list(None)
+    
+    total = await db.player_tournament_stats.count_documents({})
+    return {"success": True, "players": total}
+
+
 @router.post("/admin/create-daily")
 async def admin_create_daily_tournaments():
     """Admin endpoint to manually create daily tournaments"""
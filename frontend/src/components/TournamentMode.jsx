@@ -135,12 +135,28 @@ const TournamentCard = ({ tournament, onJoin, isJoined, myEntry }) => {
 // Leaderboard Modal
 const LeaderboardModal = ({ tournament, onClose, myEntry }) => {
   const [leaderboard, setLeaderboard] = useState([]);
+  const [rewardTiers, setRewardTiers] = useState(tournament.reward_tiers || []);
   const [loading, setLoading] = useState(true);
   
+  // The lobby list only carries the top reward tiers - load the full list
+  useEffect(() => {
+    const loadRewards = async () => {
+      try {
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/tournaments/${tournament.id}`);
+        const data = await response.json();
+        setRewardTiers(data.reward_tiers || []);
+      } catch (err) {
+        console.error('Failed to load tournament rewards:', err);
+      }
+    };
+    loadRewards();
+  }, [tournament.id]);
+  
   useEffect(() => {
     const loadLeaderboard = async () => {
       try {
-        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/tournaments/${tournament.id}/leaderboard?limit=50`);
+        const bracket = myEntry?.bracket_id ? `&bracket_id=${myEntry.bracket_id}` : '';
+        const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/tournaments/${tournament.id}/leaderboard?limit=50${bracket}`);
         const data = await response.json();
         setLeaderboard(data.leaderboard || []);
       } catch (err) {
@@ -149,7 +165,7 @@ const LeaderboardModal = ({ tournament, onClose, myEntry }) => {
       setLoading(false);
     };
     loadLeaderboard();
-  }, [tournament.id]);
+  }, [tournament.id, myEntry?.bracket_id]);
   
   return (
     <div className="fixed inset-0 z-50 flex items-center justify-center p-4 bg-black/80 animate-backdrop" onClick={onClose}>
@@ -229,7 +245,7 @@ const LeaderboardModal = ({ tournament, onClose, myEntry }) => {
         <div className="mt-6 pt-4 border-t border-white/10">
           <h3 className="text-white font-bold mb-3">Rewards</h3>
           <div className="grid grid-cols-2 gap-2">
-            {tournament.reward_tiers?.map((tier, i) => (
+            {rewardTiers.map((tier, i) => (
               <div key={i} className="bg-white/5 rounded-xl p-3">
                 <div className="flex items-center gap-2 mb-1">
                   <span>{TROPHY_ICONS[tier.trophy_type]}</span>